@@ -0,0 +1,44 @@
+"""
+Compares the speed of `SumDiffTransformer.transform` with the original
+implementation filling the result column by column in a double loop.
+
+Run it as `python -m benchmarks.sum_diff` from the repository root, so the
+`kaggletools` package is importable without installing it.
+"""
+
+import timeit
+
+import numpy as np
+
+from kaggletools.select_features import SumDiffTransformer
+
+def loop_transform(X):
+    """
+    The original implementation of `SumDiffTransformer.transform`.
+    """
+    X_new = np.zeros([X.shape[0], X.shape[1] * X.shape[1]])
+    for i in range(0, X.shape[1]):
+        for j in range(0, X.shape[1]):
+            if i > j:
+                X_new[:, i * X.shape[1] + j] = X[:, i] + X[:, j]
+            elif i < j:
+                X_new[:, i * X.shape[1] + j] = X[:, i] - X[:, j]
+            else:
+                X_new[:, i * X.shape[1] + j] = X[:, i]
+    return X_new
+
+def main():
+    transformer = SumDiffTransformer()
+    threaded = SumDiffTransformer(n_jobs=-1)
+    for n, p in [(1000, 50), (1000, 200), (10000, 100)]:
+        X = np.random.RandomState(0).randn(n, p)
+        assert np.array_equal(loop_transform(X), transformer.transform(X))
+        assert np.array_equal(loop_transform(X), threaded.transform(X))
+        loop = min(timeit.repeat(lambda: loop_transform(X), number=1, repeat=3))
+        vectorized = min(timeit.repeat(lambda: transformer.transform(X), number=1, repeat=3))
+        parallel = min(timeit.repeat(lambda: threaded.transform(X), number=1, repeat=3))
+        print("n = %d, p = %d: loop %.3f s, vectorized %.3f s (%.1fx), threads %.3f s (%.1fx)"
+              % (n, p, loop, vectorized, loop / vectorized, parallel, loop / parallel))
+
+if __name__ == '__main__':
+    main()
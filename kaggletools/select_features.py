@@ -4,17 +4,653 @@ models only.
 """
 
 import numpy as np
+import pandas as pd
 
 from sklearn.base import BaseEstimator
 from sklearn.base import TransformerMixin
+from sklearn.base import clone
+from sklearn.exceptions import NotFittedError
 
-from sklearn.model_selection import cross_validate
+from sklearn.linear_model import LinearRegression
+from sklearn.linear_model import Ridge
+
+from sklearn.metrics import r2_score
 from sklearn.model_selection import ShuffleSplit
 
+from scipy import sparse
+from scipy.linalg import solve_triangular
+
+from joblib import Parallel
+from joblib import delayed
+from joblib import dump
+from joblib import effective_n_jobs
+from joblib import hash as _hash
+from joblib import load
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import os
+import shutil
+import signal
+import sqlite3
+import tempfile
+import threading
+import time
+
 # Needed to conserve memory
 import gc
 
-def select_features_ascending(data, y, model, verbose=False, starting_features=None, n_jobs=None):
+# Relative size of the part of a candidate column not explained by already
+# selected columns below which the candidate is considered collinear with
+# them and gets no coefficient of its own.
+_COLLINEAR_TOL = 1e-10
+
+# Relative improvement of the mean testing score a candidate must make to
+# be selected, so that rounding errors never select a useless feature.
+_SCORE_TOL = 1e-10
+
+# Racing parameters: candidates are compared after this number of splits
+# and dropped if this many standard errors can not make them win.
+_RACING_MIN_SPLITS = 3
+_RACING_BOUND = 3.0
+
+# Fraction of candidates promoted from a row subsample to the next one.
+_SUBSAMPLE_KEEP = 1.0 / 3.0
+
+def _shuffle_split():
+    """
+    Returns the cross-validator used to score every feature subset.
+    """
+    return ShuffleSplit(n_splits=10,
+                        random_state=0,
+                        train_size=0.75,
+                        test_size=0.25)
+
+class _SelectionStopped(Exception):
+    """
+    Raised to stop a selector when its budget is over or on SIGTERM.
+    """
+
+class _Budget(object):
+    """
+    Limits on the running time and the number of evaluations (scores of
+    a subset on a single split) of a selector run, and the counter of
+    evaluations done so far.
+    """
+
+    def __init__(self, max_time=None, max_evaluations=None):
+        self.max_time = max_time
+        self.max_evaluations = max_evaluations
+        self.started = time.time()
+        self.evaluations = 0
+
+    def limited(self):
+        """
+        Checks whether any limit is set.
+        """
+        return self.max_time is not None or self.max_evaluations is not None
+
+    def allowed(self, n):
+        """
+        Returns how many of `n` more evaluations may be done, at least one.
+        Raises `_SelectionStopped` if the time is over or no evaluations
+        are left.
+        """
+        if self.max_time is not None and time.time() - self.started >= self.max_time:
+            raise _SelectionStopped()
+        if self.max_evaluations is None:
+            return n
+        left = self.max_evaluations - self.evaluations
+        if left <= 0:
+            raise _SelectionStopped()
+        return min(n, left)
+
+    def reserve(self, n):
+        """
+        Counts `n` evaluations done at once. Raises `_SelectionStopped`
+        if they do not fit into the budget.
+        """
+        if self.allowed(n) < n:
+            raise _SelectionStopped()
+        self.evaluations += n
+
+@contextmanager
+def _stop_on_sigterm():
+    """
+    Turns SIGTERM into `_SelectionStopped` while a selector runs. Signal
+    handlers may only be set from the main thread, so elsewhere SIGTERM
+    is left alone.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    def _handler(signum, frame):
+        raise _SelectionStopped()
+    previous = signal.signal(signal.SIGTERM, _handler)
+    try:
+        yield
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL if previous is None else previous)
+
+def _temp_root(nbytes):
+    """
+    Returns the folder to dump an array of `nbytes` bytes to, the same one
+    joblib would use for its own memory-mapped arrays: the `JOBLIB_TEMP_FOLDER`
+    environment variable if set, otherwise the shared memory filesystem if it
+    exists and has enough free space, otherwise None meaning the default
+    temporary folder.
+    """
+    folder = os.environ.get('JOBLIB_TEMP_FOLDER')
+    if folder is not None:
+        return os.path.expanduser(folder)
+    if os.path.isdir('/dev/shm'):
+        try:
+            stats = os.statvfs('/dev/shm')
+        except OSError:
+            return None
+        if stats.f_bavail * stats.f_frsize > 2 * nbytes:
+            return '/dev/shm'
+    return None
+
+@contextmanager
+def _shared_matrix(data, n_jobs=None):
+    """
+    Converts the `data` frame into a single contiguous array once. If the
+    models are fitted in parallel, the array is dumped to a temporary folder,
+    in shared memory if possible, and memory-mapped, so the workers receive
+    a reference to the file rather than a pickled copy and all of them read
+    columns from the same pages. The folder is removed on exit.
+    """
+    X = np.ascontiguousarray(data.values)
+    if n_jobs is None or n_jobs == 1:
+        yield X
+        return
+    folder = tempfile.mkdtemp(prefix='kaggletools_', dir=_temp_root(X.nbytes))
+    try:
+        filename = os.path.join(folder, 'data.mmap')
+        dump(X, filename)
+        del X
+        yield load(filename, mmap_mode='r')
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+def _fit_and_score(model, X, y, columns, train, test):
+    """
+    Fits a copy of the `model` on the `train` rows and the given `columns`
+    of `X` and returns its R2 score on the `test` rows.
+    """
+    model = clone(model)
+    model.fit(X[np.ix_(train, columns)], y[train])
+    return r2_score(y[test], model.predict(X[np.ix_(test, columns)]))
+
+class ScoreCache(object):
+    """
+    Persistent cache of cross-validation scores of feature subsets, stored
+    in an SQLite database file. Every score is stored as soon as the fold
+    is fitted, so a killed selector loses almost nothing and the next run
+    with the same cache file, including a run of another selector, reuses
+    every subset already scored.
+
+    A score is identified by the context (the model class and parameters,
+    the cross-validator and a fingerprint of the data and target), the
+    subset of column indices and the index of the split.
+    """
+
+    def __init__(self, filename):
+        """
+        Open the cache file, creating it if it does not exist.
+
+        Parameters
+        ----------
+        filename : str
+            Path to the SQLite database file.
+        """
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS scores ("
+                                "context TEXT, subset TEXT, split INTEGER, score REAL, "
+                                "PRIMARY KEY (context, subset, split))")
+        self.connection.commit()
+
+    def get(self, context, subset):
+        """
+        Returns a dict mapping split indices to known scores of the subset.
+        """
+        rows = self.connection.execute("SELECT split, score FROM scores WHERE context = ? AND subset = ?",
+                                       (context, subset))
+        return dict(rows.fetchall())
+
+    def put(self, context, scores):
+        """
+        Stores a list of `(subset, split, score)` tuples.
+        """
+        self.connection.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)",
+                                    [(context, subset, int(split), float(score))
+                                     for subset, split, score in scores])
+        self.connection.commit()
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+@contextmanager
+def _open_cache(cache):
+    """
+    Opens the `ScoreCache` if a path to its file is given and closes it on
+    exit. A cache object given is used as it is and left open.
+    """
+    if not isinstance(cache, str):
+        yield cache
+        return
+    with ScoreCache(cache) as opened:
+        yield opened
+
+class _CVScorer(object):
+    """
+    Scores subsets of columns of `X` by fitting the model on every split of
+    `_shuffle_split()`. All (subset, split) pairs of a selection step are
+    dispatched to the workers as a single flat list of tasks, so `n_jobs`
+    cores are busy even if there are fewer splits than cores. If a cache is
+    given, pairs already scored are looked up there and new scores are
+    written to it in batches of a few tasks per worker. The `fingerprint`
+    of `X` and `y` identifying the data in the cache should be computed
+    once by `_hash([X, y])` and shared by all the scorers of a selector. The same batches
+    are used to check the budget if it is limited. If `rows` are given,
+    the splits are made of these rows only, so a subsample is scored without
+    copying anything out of `X`.
+    """
+
+    def __init__(self, model, X, y, n_jobs=None, cache=None, features=None, rows=None,
+                 budget=None, fingerprint=None):
+        self.model = model
+        self.budget = _Budget() if budget is None else budget
+        self.X = X
+        self.y = y
+        self.n_jobs = n_jobs
+        if rows is None:
+            self.splits = list(_shuffle_split().split(X))
+        else:
+            self.splits = [(rows[train], rows[test])
+                           for train, test in _shuffle_split().split(rows[:, None])]
+        self.cache = cache
+        if cache is not None:
+            self.context = _hash([type(model).__module__,
+                                  type(model).__name__,
+                                  model.get_params(),
+                                  repr(_shuffle_split()),
+                                  [str(f) for f in features],
+                                  _hash([X, y]) if fingerprint is None else fingerprint,
+                                  rows])
+
+    def scores(self, subsets, splits=None):
+        """
+        Returns an array of shape `(len(splits), len(subsets))` containing
+        testing R2 scores of the model fitted on every subset of columns
+        (given as lists of column indices) on every split whose index is
+        listed in `splits`, by default on all splits. The columns of a
+        subset are always taken in the order of `X`, so a subset has the
+        same score however it was reached.
+        """
+        if splits is None:
+            splits = range(0, len(self.splits))
+        rows = {i: r for r, i in enumerate(splits)}
+        subsets = [sorted(columns) for columns in subsets]
+        scores = np.zeros([len(rows), len(subsets)])
+        known = np.zeros(scores.shape, dtype=bool)
+        keys = [",".join(str(c) for c in columns) for columns in subsets]
+        if self.cache is not None:
+            for k, key in enumerate(keys):
+                for i, score in self.cache.get(self.context, key).items():
+                    if i in rows:
+                        scores[rows[i], k] = score
+                        known[rows[i], k] = True
+        tasks = [(k, i) for k in range(0, len(subsets))
+                 for i in splits if not known[rows[i], k]]
+        if not tasks:
+            return scores
+        if self.cache is None and not self.budget.limited():
+            batch = len(tasks)
+        else:
+            batch = 4 * effective_n_jobs(self.n_jobs)
+        with Parallel(n_jobs=self.n_jobs) as parallel:
+            start = 0
+            while start < len(tasks):
+                chunk = tasks[start:start + self.budget.allowed(batch)]
+                start += len(chunk)
+                results = parallel(delayed(_fit_and_score)(self.model, self.X, self.y, subsets[k],
+                                                           *self.splits[i])
+                                   for k, i in chunk)
+                self.budget.evaluations += len(chunk)
+                for (k, i), score in zip(chunk, results):
+                    scores[rows[i], k] = score
+                if self.cache is not None:
+                    self.cache.put(self.context, [(keys[k], i, score)
+                                                  for (k, i), score in zip(chunk, results)])
+        return scores
+
+    def race(self, subsets, threshold=None):
+        """
+        Scores the subsets split by split, dropping the ones that can not
+        win. After `_RACING_MIN_SPLITS` splits a subset is dropped if the
+        mean difference between its scores and the ones of the current
+        leader plus `_RACING_BOUND` standard errors of that difference is
+        still negative, or if its mean score plus the same number of
+        standard errors is below the `threshold` score it has to beat.
+        Returns the same array as `scores`, with NaN values for splits
+        skipped for dropped subsets.
+        """
+        scores = np.full([len(self.splits), len(subsets)], np.nan)
+        alive = np.arange(0, len(subsets))
+        for i in range(0, len(self.splits)):
+            scores[i, alive] = self.scores([subsets[k] for k in alive], [i])[0]
+            n = i + 1
+            if n < _RACING_MIN_SPLITS or n == len(self.splits):
+                continue
+            part = scores[:n, alive]
+            mean = part.mean(axis=0)
+            diff = part - part[:, [mean.argmax()]]
+            bound = _RACING_BOUND / np.sqrt(n)
+            keep = diff.mean(axis=0) + bound * diff.std(axis=0, ddof=1) >= 0
+            if threshold is not None:
+                keep &= mean + bound * part.std(axis=0, ddof=1) >= threshold
+            alive = alive[keep]
+            if not len(alive):
+                break
+        return scores
+
+def _subsample_rows(n_rows, fractions=None):
+    """
+    Returns a list of sorted arrays of row indices, one for every fraction
+    of `n_rows` in `fractions`, from the smallest to the largest. Every
+    subsample contains all the smaller ones.
+    """
+    if not fractions:
+        return []
+    order = np.random.RandomState(0).permutation(n_rows)
+    result = []
+    for fraction in sorted(fractions):
+        if not 0.0 < fraction < 1.0:
+            raise ValueError("Subsample fractions must be between 0 and 1, got %s" % str(fraction))
+        result.append(np.sort(order[:int(fraction * n_rows)]))
+    return result
+
+def _step_scores(scorers, subsets, threshold=None, racing=False):
+    """
+    Scores the candidate subsets of a selection step. Every scorer but the
+    last one scores the candidates on a row subsample and only the best
+    `_SUBSAMPLE_KEEP` fraction of them is promoted to the next one. The
+    last scorer, working on all the rows, scores the remaining candidates
+    by `race` if `racing` is True and by `scores` otherwise. Candidates
+    not promoted get NaN scores.
+    """
+    alive = np.arange(0, len(subsets))
+    for scorer in scorers[:-1]:
+        means = scorer.scores([subsets[k] for k in alive]).mean(axis=0)
+        keep = max(1, int(np.ceil(len(alive) * _SUBSAMPLE_KEEP)))
+        alive = np.sort(alive[np.argsort(-means, kind='mergesort')[:keep]])
+    scores = np.full([len(scorers[-1].splits), len(subsets)], np.nan)
+    promoted = [subsets[k] for k in alive]
+    if racing:
+        scores[:, alive] = scorers[-1].race(promoted, threshold)
+    else:
+        scores[:, alive] = scorers[-1].scores(promoted)
+    return scores
+
+def _improves(score, best_score):
+    """
+    Checks whether the `score` is better than the `best_score` by more than
+    a rounding error. Any score improves the missing (None) best score.
+    """
+    return best_score is None or score > best_score + _SCORE_TOL * max(abs(best_score), 1.0)
+
+def _dropped(features, test_scores, verbose=False):
+    """
+    Checks whether a candidate was dropped by racing or on row subsamples
+    before being fitted on every split, displaying its partial score in
+    verbose mode.
+    """
+    if not np.isnan(test_scores).any():
+        return False
+    if verbose:
+        test_scores = test_scores[~np.isnan(test_scores)]
+        print("Features: %s" % str(features))
+        if len(test_scores):
+            print("  Dropped after %d splits: %s" % (len(test_scores), _score_str(test_scores)))
+        else:
+            print("  Dropped on row subsamples")
+    return True
+
+def _score_str(test_scores):
+    """
+    Formats the testing scores the way they are displayed in verbose mode.
+    """
+    return "%lf +/- %lf" % (test_scores.mean(), 3 * test_scores.std())
+
+class _LinearFold(object):
+    """
+    Sufficient statistics of a single cross-validation split for a linear
+    model: the Gram matrix of the (centered) training data, the same for
+    the testing data centered by training means, and the Cholesky factor
+    of the Gram matrix restricted to the currently selected columns.
+    Every feature subset is then scored without touching the rows again.
+    """
+
+    def __init__(self, X, y, train, test, alpha, fit_intercept):
+        X_train = X[train]
+        y_train = y[train]
+        if fit_intercept:
+            x_mean = X_train.mean(axis=0)
+            y_mean = y_train.mean()
+        else:
+            x_mean = np.zeros(X.shape[1])
+            y_mean = 0.0
+        X_train = X_train - x_mean
+        y_train = y_train - y_mean
+        self.gram = X_train.T @ X_train
+        self.gram[np.diag_indices_from(self.gram)] += alpha
+        self.xty = X_train.T @ y_train
+        X_test = X[test] - x_mean
+        y_test = y[test] - y_mean
+        self.test_gram = X_test.T @ X_test
+        self.test_xty = X_test.T @ y_test
+        self.test_yty = y_test @ y_test
+        self.test_sst = ((y[test] - y[test].mean()) ** 2).sum()
+        self.chol = np.zeros([0, 0])
+
+    def _r2(self, S, W, C=None, c=None):
+        """
+        Testing R2 scores of the models with coefficients `W[:, k]` on
+        columns `S`, plus coefficient `c[k]` on column `C[k]` if given.
+        """
+        H = self.test_gram
+        h = self.test_xty
+        sse = self.test_yty - 2 * (h[S] @ W) + (W * (H[np.ix_(S, S)] @ W)).sum(axis=0)
+        if C is not None:
+            sse = (sse - 2 * h[C] * c
+                   + 2 * c * (H[np.ix_(S, C)] * W).sum(axis=0)
+                   + c * c * H[C, C])
+        # The expansion cancels catastrophically on near-exact fits and may
+        # even turn negative, while a true sum of squares can not.
+        return 1.0 - np.maximum(sse, 0.0) / self.test_sst
+
+    def start(self, S):
+        """
+        Factorizes the Gram matrix of the starting columns `S` column by
+        column, so columns collinear with the previous ones are handled the
+        same way as by `append` instead of failing the factorization.
+        """
+        self.chol = np.zeros([0, 0])
+        for k in range(0, len(S)):
+            self.append(S[:k], S[k])
+
+    def add_scores(self, S, C):
+        """
+        Testing R2 scores of the models fitted on `S + [C[k]]` for every
+        candidate column `C[k]`, using a rank-one extension of the
+        Cholesky factor of the selected columns `S`.
+        """
+        G = self.gram
+        b = self.xty
+        g = G[C, C]
+        if len(S):
+            L = self.chol
+            V = solve_triangular(L, G[np.ix_(S, C)], lower=True)
+            z = solve_triangular(L, b[S], lower=True)
+            w = solve_triangular(L.T, z, lower=False)
+            U = solve_triangular(L.T, V, lower=False)
+            d2 = g - (V * V).sum(axis=0)
+            num = b[C] - V.T @ z
+        else:
+            U = np.zeros([0, len(C)])
+            w = np.zeros(0)
+            d2 = g
+            num = b[C]
+        ok = d2 > _COLLINEAR_TOL * g
+        c = np.where(ok, num / np.where(ok, d2, 1.0), 0.0)
+        W = w[:, None] - U * c[None, :]
+        return self._r2(S, W, C, c)
+
+    def score(self, S):
+        """
+        Testing R2 score of the model fitted on the columns `S`.
+        """
+        w = np.zeros(0)
+        if len(S):
+            z = solve_triangular(self.chol, self.xty[S], lower=True)
+            w = solve_triangular(self.chol.T, z, lower=False)
+        return self._r2(S, w[:, None])[0]
+
+    def remove_scores(self, S):
+        """
+        Testing R2 scores of the models fitted on `S` without `S[k]` for
+        every `k`. The coefficients of every such model are obtained from
+        the ones fitted on `S` by the downdate `w - w[k] / P[k, k] * P[:, k]`,
+        where `P` is the inverse of the Gram matrix known from its Cholesky
+        factor, so all removals are scored by a few batched matrix products.
+        """
+        k = len(S)
+        L_inv = solve_triangular(self.chol, np.eye(k), lower=True)
+        P = L_inv.T @ L_inv
+        w = P @ self.xty[S]
+        W = w[:, None] - P * (w / np.diag(P))[None, :]
+        # The removed coefficient is exactly zero, not a rounding error.
+        W[np.diag_indices(k)] = 0.0
+        return self._r2(S, W)
+
+    def remove(self, S, pos):
+        """
+        Removes the column `S[pos]` from the Cholesky factor of the
+        columns `S`. Deleting a row of the factor leaves its trailing part
+        non-triangular, so that part is retriangulated by a QR decomposition.
+        """
+        L = np.delete(self.chol, pos, axis=0)
+        L_new = L[:, :-1].copy()
+        if pos < len(S) - 1:
+            R = np.linalg.qr(L[pos:, pos:].T, mode='r')
+            L_new[pos:, pos:] = R.T
+        self.chol = L_new
+
+    def append(self, S, j):
+        """
+        Extends the Cholesky factor of the columns `S` by the column `j`.
+        """
+        k = len(S)
+        L = np.zeros([k + 1, k + 1])
+        if k:
+            l = solve_triangular(self.chol, self.gram[S, j], lower=True)
+            L[:k, :k] = self.chol
+            L[k, :k] = l
+            d2 = self.gram[j, j] - l @ l
+        else:
+            d2 = self.gram[j, j]
+        L[k, k] = np.sqrt(max(d2, _COLLINEAR_TOL * max(self.gram[j, j], 1.0)))
+        self.chol = L
+
+class _LinearCV(object):
+    """
+    Closed-form replacement of `_CVScorer` for `LinearRegression` and
+    `Ridge` models used by the selectors with `engine='linear'`. Scores
+    are computed on the same `_shuffle_split()` splits, so they agree with
+    the ones `_CVScorer` returns up to rounding errors.
+    """
+
+    def __init__(self, X, y, model):
+        alpha, fit_intercept = _linear_params(model)
+        X = np.asarray(X, dtype=float)
+        y = np.asarray(y, dtype=float)
+        self.folds = [_LinearFold(X, y, train, test, alpha, fit_intercept)
+                      for train, test in _shuffle_split().split(X)]
+        self.selected = []
+
+    def start(self, S):
+        """
+        Sets the currently selected column indices.
+        """
+        self.selected = list(S)
+        for fold in self.folds:
+            fold.start(self.selected)
+
+    def add_scores(self, C):
+        """
+        Returns an array of shape `(n_splits, len(C))` containing testing
+        scores of the selected columns extended by every column of `C`.
+        """
+        return np.array([fold.add_scores(self.selected, list(C)) for fold in self.folds])
+
+    def append(self, j):
+        """
+        Adds the column `j` to the selected columns.
+        """
+        for fold in self.folds:
+            fold.append(self.selected, j)
+        self.selected.append(j)
+
+    def scores(self):
+        """
+        Returns testing scores of the selected columns on every split.
+        """
+        return np.array([fold.score(self.selected) for fold in self.folds])
+
+    def remove_scores(self):
+        """
+        Returns an array of shape `(n_splits, len(self.selected))`
+        containing testing scores of the selected columns without
+        every single one of them.
+        """
+        return np.array([fold.remove_scores(self.selected) for fold in self.folds])
+
+    def remove(self, j):
+        """
+        Removes the column `j` from the selected columns.
+        """
+        pos = self.selected.index(j)
+        for fold in self.folds:
+            fold.remove(self.selected, pos)
+        del self.selected[pos]
+
+def _linear_params(model):
+    """
+    Returns the `(alpha, fit_intercept)` pair describing a model supported
+    by the linear engine. Raises ValueError for any other model.
+    """
+    if isinstance(model, Ridge) and np.ndim(model.alpha) == 0 and not getattr(model, 'positive', False):
+        return float(model.alpha), model.fit_intercept
+    if isinstance(model, LinearRegression) and not getattr(model, 'positive', False):
+        return 0.0, model.fit_intercept
+    raise ValueError("engine='linear' supports only LinearRegression and Ridge with scalar alpha, got %s"
+                     % type(model).__name__)
+
+def select_features_ascending(data, y, model, verbose=False, starting_features=None, n_jobs=None,
+                              engine='cv', cache=None, racing=False, subsample=None,
+                              max_time=None, max_evaluations=None, return_evaluations=False):
     """
     Selects the best features for model fitting. First, selects the first
     feature providing the best-fitted model on this feature only. Then,
@@ -42,61 +678,162 @@ def select_features_ascending(data, y, model, verbose=False, starting_features=N
         Start with this set of features, default is start with empty set.
 
     n_jobs : int, optional
-        Pass this as n_jobs to cross_validators.
+        The number of jobs to fit models in parallel. Every candidate
+        subset of a selection step is fitted on every split at the same
+        time, so up to `n_splits * n_candidates` cores are used. Use
+        `joblib.parallel_backend('threading')` to run them in threads.
+        For parallel runs the data frame is converted once into a
+        memory-mapped array in a temporary folder that all the workers
+        share instead of receiving copies of the selected columns.
+
+    engine : str, default 'cv'
+        How to score candidate feature subsets. The 'cv' value means to
+        fit the model on every candidate subset for every split.
+        The 'linear' value is only allowed for `LinearRegression` and
+        `Ridge` models. It computes the Gram matrices of every split once
+        and scores every candidate by a rank-one extension of the Cholesky
+        factor of the selected features, so no model is refitted at all.
+        Both engines use the same splits and return the same scores up to
+        rounding errors.
+
+    cache : str or ScoreCache, optional
+        Path to an SQLite file (or an open `ScoreCache`) to store the score
+        of every subset and split in as soon as it is computed. Scores
+        already found there for the same model parameters and data are
+        not computed again, so a killed run may be restarted, or followed
+        by `select_features_descending`, at little cost. Only used by the
+        'cv' engine.
+
+    racing : bool, default False
+        Score the candidates of every step split by split and stop fitting
+        the ones that clearly can not be selected. After three splits, a
+        candidate is dropped if its score is below the one of the current
+        leader by more than three standard errors of their difference, or
+        below the score it has to beat by more than three standard errors.
+        Dropped candidates are never selected. On wide data this saves most
+        of the fits and selects the same features unless several candidates
+        are nearly equally good. Only used by the 'cv' engine.
+
+    subsample : list of float, optional
+        Fractions of rows, e.g. `[0.05, 0.25]`, to pre-score the candidates
+        of every step on. All candidates are scored on the smallest
+        subsample, the best third of them is promoted to the next one and
+        so on, and only the candidates promoted from the largest subsample
+        are scored on all the rows. The selection itself is always made by
+        the scores on all the rows. Subsamples are nested and drawn once
+        per run. Only used by the 'cv' engine.
+
+    max_time : float, optional
+        Stop after this number of seconds and return the features selected
+        by the last completed step. The limit is checked between batches of
+        a few fits per worker, so it may be exceeded by the time of one such
+        batch. Interrupting the run by Ctrl-C or SIGTERM stops it the same
+        way.
+
+    max_evaluations : int, optional
+        Stop before fitting more than this number of models on a single
+        split (or scoring that many subsets on a split by the 'linear'
+        engine), the same way as when the `max_time` is over. Scores taken
+        from the cache are not counted.
+
+    return_evaluations : bool, default False
+        Also return the number of evaluations done.
 
     Returns
     -------
     list :
         The list of column names to fit the model on.
 
+    int :
+        The number of models fitted on a single split, only returned if
+        `return_evaluations` is True.
+
+    Raises
+    ------
+    ValueError :
+        Unknown engine, the 'linear' engine requested for a model it does
+        not support, or a subsample fraction not between 0 and 1.
+
     Known bugs
     ----------
     It would be good to have a `verbose` option. By default, much debugging
     output is written to stdout and this is not always good.
     """
     all_features = list(data.columns)
+    index = {f: i for i, f in enumerate(all_features)}
+    y = np.asarray(y)
     selected_features = []
     if starting_features:
         selected_features.extend(starting_features)
-    best_score = None
+    budget = _Budget(max_time, max_evaluations)
     best_score_str = None
-    for n in range(0, len(all_features)):
-        best_features = None
-        for f in set(all_features) - set(selected_features):
-            try_features = selected_features + [f]
-            cv = cross_validate(estimator=model,
-                                X=data[try_features].values,
-                                y=y,
-                                scoring='r2',
-                                return_train_score=True,
-                                cv=ShuffleSplit(n_splits=10,
-                                                random_state=0,
-                                                train_size=0.75,
-                                                test_size=0.25),
-                                n_jobs=n_jobs)
-            score = cv['test_score'].mean()
-            score_str = "%lf +/- %lf" % (cv['test_score'].mean(), 3 * cv['test_score'].std())
-            if verbose:
-                print("Features: %s" % str(try_features))
-                print("  Testing score: %s" % score_str)
-            if best_score is None or score > best_score:
-                best_features = try_features
-                best_score = score
-                best_score_str = score_str
-        if best_features:
-            selected_features = best_features
-            if verbose:
-                print("Currently selected features: %s" % str(best_features))
-                print("Best score: %s" % best_score_str)
-        else:
+    # The linear engine never dispatches any work to other processes.
+    with _shared_matrix(data, n_jobs if engine == 'cv' else None) as X, \
+            _stop_on_sigterm(), _open_cache(cache) as cache:
+        try:
+            if engine == 'linear':
+                linear = _LinearCV(X, y, model)
+                linear.start([index[f] for f in selected_features])
+            elif engine == 'cv':
+                linear = None
+                fingerprint = None if cache is None else _hash([X, y])
+                scorers = [_CVScorer(model, X, y, n_jobs, cache, all_features, rows, budget, fingerprint)
+                           for rows in _subsample_rows(len(y), subsample)]
+                scorers.append(_CVScorer(model, X, y, n_jobs, cache, all_features,
+                                         budget=budget, fingerprint=fingerprint))
+            else:
+                raise ValueError("Unknown engine: %s" % str(engine))
+            best_score = None
+            for n in range(0, len(all_features)):
+                best_features = None
+                candidates = [f for f in all_features if f not in selected_features]
+                subsets = [selected_features + [f] for f in candidates]
+                if not candidates:
+                    step_scores = None
+                elif linear is None:
+                    step_scores = _step_scores(scorers, [[index[f] for f in s] for s in subsets],
+                                               best_score, racing)
+                else:
+                    budget.reserve(len(linear.folds) * len(candidates))
+                    step_scores = linear.add_scores([index[f] for f in candidates])
+                for k, try_features in enumerate(subsets):
+                    test_scores = step_scores[:, k]
+                    if _dropped(try_features, test_scores, verbose):
+                        continue
+                    score = test_scores.mean()
+                    score_str = _score_str(test_scores)
+                    if verbose:
+                        print("Features: %s" % str(try_features))
+                        print("  Testing score: %s" % score_str)
+                    if _improves(score, best_score):
+                        best_features = try_features
+                        best_score = score
+                        best_score_str = score_str
+                if best_features:
+                    selected_features = best_features
+                    if linear is not None:
+                        linear.append(index[best_features[-1]])
+                    if verbose:
+                        print("Currently selected features: %s" % str(best_features))
+                        print("Best score: %s" % best_score_str)
+                else:
+                    if verbose:
+                        print("Best features: %s" % str(selected_features))
+                        print("Best score: %s" % best_score_str)
+                    break
+                gc.collect()
+        except (_SelectionStopped, KeyboardInterrupt):
             if verbose:
+                print("Stopped after %d evaluations" % budget.evaluations)
                 print("Best features: %s" % str(selected_features))
                 print("Best score: %s" % best_score_str)
-            break
-        gc.collect()
+    if return_evaluations:
+        return selected_features, budget.evaluations
     return selected_features
 
-def select_features_descending(data, y, model, verbose=False, n_jobs=None):
+def select_features_descending(data, y, model, verbose=False, n_jobs=None, engine='cv',
+                               cache=None, racing=False, subsample=None, max_time=None,
+                               max_evaluations=None, return_evaluations=False):
     """
     Selects the best features for model fitting. First, fits the model on all
     features, then tries to remove every single feature while that can improve
@@ -120,66 +857,140 @@ def select_features_descending(data, y, model, verbose=False, n_jobs=None):
         Display progress information
 
     n_jobs : int, optional
-        Pass this as n_jobs to cross_validators.
+        The number of jobs to fit models in parallel. Every candidate
+        subset of a selection step is fitted on every split at the same
+        time, so up to `n_splits * n_candidates` cores are used. Use
+        `joblib.parallel_backend('threading')` to run them in threads.
+        For parallel runs the data frame is converted once into a
+        memory-mapped array in a temporary folder that all the workers
+        share instead of receiving copies of the selected columns.
+
+    engine : str, default 'cv'
+        How to score candidate feature subsets, see
+        `select_features_ascending`. With the 'linear' engine the Gram
+        matrices are computed once per split and the scores of removing
+        every single feature are obtained together from a downdate of
+        the fitted coefficients, the Cholesky factor being downdated after
+        every removal.
+
+    cache : str or ScoreCache, optional
+        Path to an SQLite file (or an open `ScoreCache`) to reuse scores
+        from and store them to, see `select_features_ascending`.
+
+    racing : bool, default False
+        Drop the candidates that clearly can not be selected before fitting
+        them on all the splits, see `select_features_ascending`.
+
+    subsample : list of float, optional
+        Fractions of rows to pre-score the candidates on, promoting only
+        the best of them to the full data, see `select_features_ascending`.
+
+    max_time : float, optional
+        Stop after this number of seconds and return the features selected
+        so far, see `select_features_ascending`. Ctrl-C and SIGTERM stop
+        the run the same way.
+
+    max_evaluations : int, optional
+        Stop before fitting more than this number of models on a single
+        split, see `select_features_ascending`.
+
+    return_evaluations : bool, default False
+        Also return the number of evaluations done.
 
     Returns
     -------
     list :
         The list of column names to fit the model on.
 
+    int :
+        The number of models fitted on a single split, only returned if
+        `return_evaluations` is True.
+
+    Raises
+    ------
+    ValueError :
+        Unknown engine, the 'linear' engine requested for a model it does
+        not support, or a subsample fraction not between 0 and 1.
+
     Known bugs
     ----------
     It would be good to have a `verbose` option. By default, much debugging
     output is written to stdout and this is not always good.
     """
     all_features = list(data.columns)
+    index = {f: i for i, f in enumerate(all_features)}
+    y = np.asarray(y)
     selected_features = all_features
-    cv = cross_validate(estimator=model,
-                        X=data.values,
-                        y=y,
-                        scoring='r2',
-                        return_train_score=True,
-                        cv=ShuffleSplit(n_splits=10,
-                                        random_state=0,
-                                        train_size=0.75,
-                                        test_size=0.25),
-                        n_jobs=n_jobs)
-    best_score = cv['test_score'].mean()
-    best_score_str = "%lf +/- %lf" % (cv['test_score'].mean(), 3 * cv['test_score'].std())
-    for n in range(0, len(all_features)):
-        best_features = None
-        for f in set(selected_features):
-            try_features = list(set(selected_features) - set([f]))
-            cv = cross_validate(estimator=model,
-                                X=data[try_features].values,
-                                y=y,
-                                scoring='r2',
-                                return_train_score=True,
-                                cv=ShuffleSplit(n_splits=10,
-                                                random_state=0,
-                                                train_size=0.75,
-                                                test_size=0.25),
-                                n_jobs=n_jobs)
-            score = cv['test_score'].mean()
-            score_str = "%lf +/- %lf" % (cv['test_score'].mean(), 3 * cv['test_score'].std())
-            if verbose:
-                print("Features: %s" % str(try_features))
-                print("  Testing score: %s" % score_str)
-            if best_score is None or score > best_score:
-                best_features = try_features
-                best_score = score
-                best_score_str = score_str
-        if best_features:
-            selected_features = best_features
-            if verbose:
-                print("Currently selected features: %s" % str(best_features))
-                print("Best score: %s" % best_score_str)
-        else:
+    budget = _Budget(max_time, max_evaluations)
+    best_score_str = None
+    # The linear engine never dispatches any work to other processes.
+    with _shared_matrix(data, n_jobs if engine == 'cv' else None) as X, \
+            _stop_on_sigterm(), _open_cache(cache) as cache:
+        try:
+            if engine == 'linear':
+                linear = _LinearCV(X, y, model)
+                linear.start(range(0, len(all_features)))
+                budget.reserve(len(linear.folds))
+                test_scores = linear.scores()
+            elif engine == 'cv':
+                linear = None
+                fingerprint = None if cache is None else _hash([X, y])
+                scorers = [_CVScorer(model, X, y, n_jobs, cache, all_features, rows, budget, fingerprint)
+                           for rows in _subsample_rows(len(y), subsample)]
+                scorers.append(_CVScorer(model, X, y, n_jobs, cache, all_features,
+                                         budget=budget, fingerprint=fingerprint))
+                test_scores = scorers[-1].scores([list(range(0, len(all_features)))])[:, 0]
+            else:
+                raise ValueError("Unknown engine: %s" % str(engine))
+            best_score = test_scores.mean()
+            best_score_str = _score_str(test_scores)
+            for n in range(0, len(all_features)):
+                best_features = None
+                removed = None
+                subsets = [[g for g in selected_features if g != f] for f in selected_features]
+                if not selected_features:
+                    step_scores = None
+                elif linear is None:
+                    step_scores = _step_scores(scorers, [[index[f] for f in s] for s in subsets],
+                                               best_score, racing)
+                else:
+                    budget.reserve(len(linear.folds) * len(selected_features))
+                    step_scores = linear.remove_scores()
+                for k, try_features in enumerate(subsets):
+                    f = selected_features[k]
+                    test_scores = step_scores[:, k]
+                    if _dropped(try_features, test_scores, verbose):
+                        continue
+                    score = test_scores.mean()
+                    score_str = _score_str(test_scores)
+                    if verbose:
+                        print("Features: %s" % str(try_features))
+                        print("  Testing score: %s" % score_str)
+                    if _improves(score, best_score):
+                        best_features = try_features
+                        removed = f
+                        best_score = score
+                        best_score_str = score_str
+                if best_features:
+                    selected_features = best_features
+                    if linear is not None:
+                        linear.remove(index[removed])
+                    if verbose:
+                        print("Currently selected features: %s" % str(best_features))
+                        print("Best score: %s" % best_score_str)
+                else:
+                    if verbose:
+                        print("Best features: %s" % str(selected_features))
+                        print("Best score: %s" % best_score_str)
+                    break
+                gc.collect()
+        except (_SelectionStopped, KeyboardInterrupt):
             if verbose:
+                print("Stopped after %d evaluations" % budget.evaluations)
                 print("Best features: %s" % str(selected_features))
                 print("Best score: %s" % best_score_str)
-            break
-        gc.collect()
+    if return_evaluations:
+        return selected_features, budget.evaluations
     return selected_features
 
 def squash_rare(data, colname, threshold=150, rare_val='Rare'):
@@ -206,10 +1017,406 @@ def squash_rare(data, colname, threshold=150, rare_val='Rare'):
         that is good if category names are all strings. If they are integers,
         an integer value must be given, best not encountered among existing
         category values.
+
+    Missing values are counted as one more category, so they are squashed
+    too if there are less than `threshold` of them and are left missing
+    otherwise. A categorical column stays categorical, its rare categories
+    being replaced by `rare_val`.
+    """
+    frequent = _frequent_categories(data[colname], threshold)
+    data[colname] = _replace_rare(data[colname], frequent, rare_val)
+
+def squash_rare_columns(data, columns, threshold=150, rare_val='Rare', default_threshold=150):
+    """
+    Squash rare categories of several columns at once, as `squash_rare`
+    does for one of them. Every column is factorized once and its values
+    are counted by `numpy.bincount` on the codes, then the squashed column
+    is built as a categorical straight from the codes and written back to
+    the data frame before the next column is processed, so only one
+    squashed column exists besides the data at a time.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        The source feature matrix. It will be modified after this call, so
+        be careful.
+
+    columns : list
+        The names of the categorical features.
+
+    threshold : int or dict, default 150
+        Treat all category values encountered less than this number of
+        times as rare. A dict maps column names to their own thresholds,
+        columns not in it use `default_threshold`.
+
+    rare_val : str or int, default 'Rare'
+        The name of the new category, see `squash_rare`. It is always one
+        of the categories of the result, even if nothing was squashed, so
+        squashed frames have the same categories whatever their data.
+
+    default_threshold : int, default 150
+        The threshold of the columns missing from a `threshold` dict.
+
+    Missing values are counted as one more category, as `squash_rare`
+    does. The columns of the result are categorical, so they take much
+    less memory than object columns.
+    """
+    for c in columns:
+        limit = threshold.get(c, default_threshold) if isinstance(threshold, dict) else threshold
+        codes, uniques = pd.factorize(data[c])
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        frequent = np.flatnonzero(counts >= limit)
+        categories = list(uniques[frequent])
+        if rare_val in categories:
+            rare_code = categories.index(rare_val)
+        else:
+            rare_code = len(categories)
+            categories.append(rare_val)
+        mapping = np.full(len(uniques) + 1, rare_code)
+        mapping[frequent] = np.arange(0, len(frequent))
+        # The last element maps the -1 code of missing values.
+        if (codes < 0).sum() >= limit:
+            mapping[-1] = -1
+        data[c] = pd.Categorical.from_codes(mapping[codes], categories)
+
+def _frequent_categories(column, threshold):
+    """
+    Returns the index of the values encountered in the column at least
+    `threshold` times, missing values counted as a value of their own.
+    """
+    counts = column.value_counts(dropna=False)
+    return counts.index[counts >= threshold]
+
+def _replace_rare(column, frequent, rare_val):
+    """
+    Returns the column with the values not listed in `frequent` replaced by
+    `rare_val`. The categories of a categorical column are the frequent ones
+    followed by `rare_val`.
+    """
+    keep = column.isin(frequent)
+    if not isinstance(column.dtype, pd.CategoricalDtype):
+        return column.where(keep, rare_val)
+    categories = column.cat.categories
+    categories = list(categories[categories.isin(frequent) & (categories != rare_val)]) + [rare_val]
+    if rare_val not in column.cat.categories:
+        column = column.cat.add_categories([rare_val])
+    return column.where(keep, rare_val).cat.set_categories(categories)
+
+class RareCategorySquasher(BaseEstimator, TransformerMixin):
+    """
+    Squashes rare categories into a single one, as `squash_rare` does, but
+    learns the frequent categories of every column from the data passed to
+    `fit`, so training and testing data are squashed the same way, and any
+    batch of data is transformed without counting categories again. The
+    values not known to be frequent, including the ones never seen by `fit`,
+    are replaced by `rare_val`.
+
+    Data not fitting in memory may be processed in chunks, e.g. read by
+    `pandas.read_csv` with `chunksize` given: the categories are counted
+    by calling `partial_fit` for every chunk, then every chunk is squashed
+    by `transform`. For columns with very many categories the counts may be
+    kept in bounded memory by a Misra-Gries sketch, see `max_categories`.
+    """
+
+    def __init__(self, columns=None, threshold=150, rare_val='Rare', max_categories=None):
+        """
+        Initialize the squasher.
+
+        Parameters
+        ----------
+        columns : list, optional
+            The names of the categorical columns to squash, all columns
+            by default.
+
+        threshold : int, default 150
+            Treat all category values encountered less than this number
+            of times in the data passed to `fit` as rare.
+
+        rare_val : str or int, default 'Rare'
+            The name of the new category, see `squash_rare`.
+
+        max_categories : int, optional
+            Keep at most this number of counters per column, as the
+            Misra-Gries heavy hitters sketch does: when there are more, the
+            count of the next most frequent category is subtracted from all
+            of them and the ones not positive any more are forgotten. Every
+            count is then underestimated by at most `n / (max_categories + 1)`,
+            `n` being the number of rows counted, so all the categories more
+            frequent than `threshold` plus that error are surely kept. All
+            the categories are counted exactly by default.
+        """
+        super(RareCategorySquasher, self).__init__()
+        self.columns = columns
+        self.threshold = threshold
+        self.rare_val = rare_val
+        self.max_categories = max_categories
+
+    def fit(self, X, y=None):
+        """
+        Learns the frequent categories of every column, forgetting the ones
+        learned before.
+
+        Parameters
+        ----------
+        X : pandas.DataFrame
+            The source data frame.
+
+        y : ignored
+
+        Returns
+        -------
+        RareCategorySquasher :
+            The fitted squasher. Its `frequent_` attribute is a dict mapping
+            column names to lists of frequent values. The category counts
+            are not kept, so the fitted state does not grow with the number
+            of categories.
+        """
+        for attribute in ['counts_', 'frequent_']:
+            if hasattr(self, attribute):
+                delattr(self, attribute)
+        self.partial_fit(X, y)
+        del self.counts_
+        return self
+
+    def partial_fit(self, X, y=None):
+        """
+        Adds the categories of another chunk of data to the counts and
+        updates the frequent categories of every column.
+
+        Parameters
+        ----------
+        X : pandas.DataFrame
+            The next chunk of the source data.
+
+        y : ignored
+
+        Returns
+        -------
+        RareCategorySquasher :
+            The fitted squasher, see `fit`. Unlike `fit`, it keeps the
+            `counts_` attribute, a dict mapping column names to Series of
+            category counts, to add the next chunk to. Counting starts
+            over after `fit`.
+        """
+        if not hasattr(self, 'counts_'):
+            columns = list(X.columns) if self.columns is None else list(self.columns)
+            self.counts_ = {c: None for c in columns}
+        for c in self.counts_:
+            counts = X[c].value_counts(dropna=False)
+            if self.counts_[c] is not None:
+                counts = self.counts_[c].add(counts, fill_value=0).astype(np.int64)
+            if self.max_categories is not None and len(counts) > self.max_categories:
+                counts = counts.sort_values(ascending=False, kind='mergesort')
+                counts = counts - counts.iloc[self.max_categories]
+                counts = counts[counts > 0]
+            self.counts_[c] = counts
+        self.frequent_ = {c: list(counts.index[counts >= self.threshold])
+                          for c, counts in self.counts_.items()}
+        return self
+
+    def transform(self, X):
+        """
+        Squashes rare categories of every column the squasher was fitted on.
+        The lookup is done by a hash table, so it takes linear time and does
+        not depend on the number of categories.
+
+        Parameters
+        ----------
+        X : pandas.DataFrame
+            The data frame to transform. It is not modified.
+
+        Returns
+        -------
+        pandas.DataFrame :
+            A copy of `X` with rare categories squashed. Categorical
+            columns stay categorical, their categories being the frequent
+            ones followed by `rare_val`.
+        """
+        if not hasattr(self, 'frequent_'):
+            raise NotFittedError("RareCategorySquasher must be fitted before transforming")
+        X = X.copy()
+        for c, frequent in self.frequent_.items():
+            X[c] = _replace_rare(X[c], frequent, self.rare_val)
+        return X
+
+
+def _sum_diff_columns(X, columns):
+    """
+    Computes the given columns of the `SumDiffTransformer` result, numbered
+    as in the full `p * p` layout, from the source feature matrix `X`.
+    """
+    i, j = np.divmod(columns, X.shape[1])
+    result = X[:, i]
+    plus = i > j
+    minus = i < j
+    result[:, plus] += X[:, j[plus]]
+    result[:, minus] -= X[:, j[minus]]
+    return result
+
+def _fill_sum_diff_blocks(X, part, blocks):
+    """
+    Fills the blocks of `p` columns of the full `SumDiffTransformer` result
+    (viewed as `blocks` of shape `(n, p, p)`) for the source features listed
+    in `part` by whole-array operations writing straight into the result.
+    NumPy releases the GIL for them, so parts may be filled by threads.
+    """
+    for i in part:
+        np.add(X[:, i:i + 1], X[:, :i], out=blocks[:, i, :i])
+        blocks[:, i, i] = X[:, i]
+        np.subtract(X[:, i:i + 1], X[:, i + 1:], out=blocks[:, i, i + 1:])
+
+def _fill_sum_diff_columns(X, columns, part, out):
+    """
+    Fills the columns `out[:, part]` with the columns `columns[part]` of
+    the full `SumDiffTransformer` result, writing every column straight into
+    `out` the same way as `_fill_sum_diff_blocks` does.
+    """
+    p = X.shape[1]
+    for k in part:
+        i, j = divmod(int(columns[k]), p)
+        if i > j:
+            np.add(X[:, i], X[:, j], out=out[:, k])
+        elif i < j:
+            np.subtract(X[:, i], X[:, j], out=out[:, k])
+        else:
+            out[:, k] = X[:, i]
+
+def _temporary_memmap(shape, dtype):
+    """
+    Returns a writable `numpy.memmap` of the given shape backed by a new
+    temporary file. Where the system allows it, the file is removed at once,
+    so its space is freed when the array is no longer used.
+    """
+    handle, filename = tempfile.mkstemp(prefix='kaggletools_', suffix='.mmap')
+    os.close(handle)
+    result = np.memmap(filename, dtype=dtype, mode='w+', shape=tuple(shape))
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+    return result
+
+def _sum_diff_operator(p, columns, dtype):
+    """
+    Returns a sparse matrix `M` of shape `(p, len(columns))` such that
+    `X @ M` is made of the given columns of the `SumDiffTransformer` result,
+    numbered as in the full `p * p` layout. Every column of `M` has a one
+    for the first feature and a one or minus one for the second.
+    """
+    i, j = np.divmod(columns, p)
+    k = np.arange(0, len(columns))
+    pair = i != j
+    rows = np.concatenate([i, j[pair]])
+    cols = np.concatenate([k, k[pair]])
+    values = np.concatenate([np.ones(len(columns)), np.where(i > j, 1.0, -1.0)[pair]])
+    return sparse.csc_matrix((values, (rows, cols)), shape=(p, len(columns)), dtype=dtype)
+
+class SumDiffMatrix(object):
+    """
+    A read-only matrix-like view of the result of `SumDiffTransformer`
+    computing its columns on demand from the source feature matrix, so it
+    takes `O(n * p)` memory instead of `O(n * p * p)`. Supports `.shape`
+    and `[rows, columns]` indexing, `columns` being an integer, a slice,
+    a list or an array of integers or a boolean mask. The recently used
+    columns are cached.
     """
-    rares = data[colname].value_counts() < threshold
-    data[colname] = data[colname].apply(lambda x: rare_val if rares[x] else x)
 
+    def __init__(self, X, cache_size=256, columns=None):
+        """
+        Initialize the matrix.
+
+        Parameters
+        ----------
+        X : numpy.ndarray
+            The source feature matrix. It is not copied, so it should not
+            be modified while the matrix is in use.
+
+        cache_size : int, default 256
+            The maximal number of columns kept in the least recently used
+            cache.
+
+        columns : numpy.ndarray, optional
+            Indices of the columns of the full `p * p` layout this matrix
+            consists of, all of them by default.
+        """
+        self.X = X
+        self.cache_size = cache_size
+        self.columns = columns
+        if columns is None:
+            self.shape = (X.shape[0], X.shape[1] * X.shape[1])
+        else:
+            self.shape = (X.shape[0], len(columns))
+        self.ndim = 2
+        self.dtype = X.dtype
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None):
+        return np.asarray(self.toarray(), dtype=dtype)
+
+    def toarray(self):
+        """
+        Returns the whole matrix as a dense array.
+        """
+        if self.columns is not None:
+            return _sum_diff_columns(self.X, self.columns)
+        return SumDiffTransformer(dtype=self.dtype).transform(self.X)
+
+    def _compute(self, X, columns):
+        """
+        Computes the given columns from the rows `X` of the source matrix.
+        """
+        if self.columns is not None:
+            columns = self.columns[columns]
+        return _sum_diff_columns(X, columns)
+
+    def _columns(self, columns):
+        """
+        Returns the given columns, taking them from the cache if possible
+        and caching the ones computed.
+        """
+        result = np.empty([self.shape[0], len(columns)], dtype=self.dtype)
+        missing = []
+        for k, c in enumerate(columns):
+            if c in self._cache:
+                self._cache.move_to_end(c)
+                result[:, k] = self._cache[c]
+            else:
+                missing.append(k)
+        if missing:
+            result[:, missing] = self._compute(self.X, columns[missing])
+            if self.cache_size:
+                for k in missing[-self.cache_size:]:
+                    self._cache[columns[k]] = result[:, k].copy()
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple) or len(key) != 2:
+            raise IndexError("SumDiffMatrix supports [rows, columns] indexing only")
+        rows, columns = key
+        if isinstance(columns, slice):
+            columns = np.arange(*columns.indices(self.shape[1]))
+        single = np.ndim(columns) == 0
+        columns = np.atleast_1d(np.asarray(columns))
+        if columns.dtype == bool:
+            columns = np.flatnonzero(columns)
+        if len(columns) and (columns.min() < -self.shape[1] or columns.max() >= self.shape[1]):
+            raise IndexError("Column index out of range for %d columns" % self.shape[1])
+        columns = columns % self.shape[1] if len(columns) else columns.astype(int)
+        if isinstance(rows, slice) and rows == slice(None):
+            result = self._columns(columns)
+        else:
+            # Columns of a part of rows are computed directly, not cached.
+            result = self._compute(np.atleast_2d(self.X[rows]), columns)
+            if isinstance(rows, (int, np.integer)):
+                result = result[0]
+        if single:
+            result = result[..., 0]
+        return result
 
 class SumDiffTransformer(BaseEstimator, TransformerMixin):
     """
@@ -217,33 +1424,271 @@ class SumDiffTransformer(BaseEstimator, TransformerMixin):
     pair of source features as new features. Does not affect quality
     of linear models, but may be good for tree-based models, despite
     will make them REALLY slower.
+
+    The result has `p * p` columns, `p` being the number of source
+    features, and may be too large to fit in memory. It can then be
+    written into a memory-mapped array passed as `out` to `transform`,
+    produced in blocks of rows by `transform_blocks`, or not produced at
+    all if `lazy` is True, the columns being computed when requested.
+
+    If `k` is given, `fit` keeps only the `k` columns most correlated with
+    the target and `transform` produces only them, in the same order as in
+    the full result. The correlations of all the columns are computed from
+    the covariance matrix of the source features, no column is built.
+
+    Sparse source matrices are transformed into sparse CSR results, as a
+    sum or difference of two sparse columns is nonzero only where one of
+    them is. The result is computed as a product of the source matrix and
+    a sparse matrix of ones and minus ones, without any dense intermediate.
+    Sparse matrices can not be transformed lazily or into `out`.
     """
 
-    def __init__(self):
+    def __init__(self, dtype=np.float64, lazy=False, k=None, n_jobs=None, max_memory=None,
+                 memory_policy='error'):
         """
-        Initialize the transformer. It does nothing so far.
+        Initialize the transformer.
+
+        Parameters
+        ----------
+        dtype : numpy.dtype or None, default numpy.float64
+            The data type of the result. None means to keep the data type
+            of the source matrix if it is a floating point one (so float32
+            features take half the memory) and to use float64 otherwise.
+
+        lazy : bool, default False
+            Make `transform` return a `SumDiffMatrix` computing the columns
+            on demand instead of a dense array.
+
+        k : int, optional
+            The number of columns of the result to keep, the ones having the
+            largest absolute correlation with the target passed to `fit`.
+            All of them are kept by default.
+
+        n_jobs : int, optional
+            The number of threads to fill a dense result by. The columns are
+            split into contiguous parts filled in place by different threads.
+
+        max_memory : int, optional
+            The maximal size in bytes of a dense result `transform` may
+            allocate. The size is estimated from the shape of the source
+            matrix before allocating anything, and if it is over the limit
+            `memory_policy` tells what to do. Not checked if `out` is given
+            or the result is lazy or sparse.
+
+        memory_policy : str, default 'error'
+            What `transform` does if the result is larger than `max_memory`.
+            The 'error' value means to raise MemoryError. The 'memmap' value
+            means to write the result into a `numpy.memmap` backed by a
+            temporary file. The 'blocks' value means to return a generator
+            of row blocks of the result, as `transform_blocks` does, every
+            block fitting into `max_memory`.
         """
         super(SumDiffTransformer, self).__init__()
+        self.dtype = dtype
+        self.lazy = lazy
+        self.k = k
+        self.n_jobs = n_jobs
+        self.max_memory = max_memory
+        self.memory_policy = memory_policy
 
     def fit(self, X, y=None):
         """
-        This transformer does not fit at all, required for
-        compatibility.
+        Chooses the columns to keep if `k` is given, otherwise does nothing.
+        The covariance of `X[:, i] +/- X[:, j]` with `y` is `c[i] +/- c[j]`
+        and its variance is `C[i, i] + C[j, j] +/- 2 * C[i, j]`, `c` and `C`
+        being covariances of the source features with `y` and each other,
+        so all `p * p` correlations take a single pass over the data.
+
+        Parameters
+        ----------
+        X : numpy.ndarray or scipy.sparse matrix
+            The source feature matrix.
+
+        y : numpy.ndarray or pandas.Series, optional
+            The target, required if `k` is given.
+
+        Returns
+        -------
+        SumDiffTransformer :
+            The fitted transformer. Its `columns_` attribute holds indices
+            of the kept columns in the full `p * p` layout, or None if all
+            of them are kept.
+
+        Raises
+        ------
+        ValueError :
+            The target is not given while `k` is.
         """
+        if self.k is None:
+            self.columns_ = None
+            return self
+        if y is None:
+            raise ValueError("SumDiffTransformer needs the target to keep k best columns")
+        y = np.asarray(y, dtype=np.float64)
+        y = y - y.mean()
+        p = X.shape[1]
+        if sparse.issparse(X):
+            # Centering would make the matrix dense, so the Gram matrix is
+            # corrected by the means instead.
+            X = sparse.csr_matrix(X, dtype=np.float64)
+            mean = np.asarray(X.mean(axis=0)).ravel()
+            cov = (X.T @ X).toarray() - X.shape[0] * np.outer(mean, mean)
+            cov_y = X.T @ y
+        else:
+            X = np.asarray(X, dtype=np.float64)
+            X = X - X.mean(axis=0)
+            cov = X.T @ X
+            cov_y = X.T @ y
+        var = np.diag(cov)
+        # The sign of the second feature of every column: +1 for sums below
+        # the diagonal, -1 for differences above it and 0 on the diagonal.
+        sign = np.tril(np.ones([p, p]), -1) - np.triu(np.ones([p, p]), 1)
+        col_cov = cov_y[:, None] + sign * cov_y[None, :]
+        col_var = var[:, None] + sign * sign * var[None, :] + 2 * sign * cov
+        with np.errstate(divide='ignore', invalid='ignore'):
+            score = np.where(col_var > 0, col_cov * col_cov / col_var, 0.0).ravel()
+        keep = np.argsort(-score, kind='mergesort')[:self.k]
+        self.columns_ = np.sort(keep)
         return self
 
-    def transform(self, X):
+    def _columns(self):
+        """
+        Returns the indices of the columns to produce, None meaning all.
+        """
+        if self.k is None:
+            return None
+        if not hasattr(self, 'columns_'):
+            raise NotFittedError("SumDiffTransformer with k given must be fitted before transforming")
+        return self.columns_
+
+    def _result_dtype(self, X):
+        """
+        Returns the data type of the result of transforming `X`.
+        """
+        if self.dtype is not None:
+            return np.dtype(self.dtype)
+        if np.issubdtype(X.dtype, np.floating):
+            return X.dtype
+        return np.dtype(np.float64)
+
+    def transform(self, X, out=None):
         """
         Does the transformation. Preserves the original features and
-        adds their sums and differences.
-        """
-        X_new = np.zeros([X.shape[0], X.shape[1] * X.shape[1]])
-        for i in range(0, X.shape[1]):
-            for j in range(0, X.shape[1]):
-                if i > j:
-                    X_new[:, i * X.shape[1] + j] = X[:, i] + X[:, j]
-                elif i < j:
-                    X_new[:, i * X.shape[1] + j] = X[:, i] - X[:, j]
+        adds their sums and differences. The column `i * p + j` of the
+        result, `p` being the number of source features, is `X[:, i] + X[:, j]`
+        if `i > j`, `X[:, i] - X[:, j]` if `i < j` and `X[:, i]` if `i == j`.
+
+        Parameters
+        ----------
+        X : numpy.ndarray or scipy.sparse matrix
+            The source feature matrix.
+
+        out : numpy.ndarray, optional
+            A C-contiguous array of shape `(X.shape[0], X.shape[1] ** 2)`,
+            or `(X.shape[0], k)` if `k` is given, e.g. a `numpy.memmap`, to
+            write the result to. A new array is allocated if not given.
+
+        Returns
+        -------
+        numpy.ndarray, scipy.sparse.csr_matrix, SumDiffMatrix or generator :
+            The extended feature matrix, `out` if it was given, a sparse
+            matrix if `X` is sparse, or a lazy `SumDiffMatrix` if the
+            transformer is lazy. If the result exceeds `max_memory`, a
+            `numpy.memmap` or a generator of row blocks, depending on
+            `memory_policy`.
+
+        Raises
+        ------
+        ValueError :
+            The `out` array has a wrong shape or is not C-contiguous, or
+            is given to a lazy transformer, or `X` is sparse while `out`
+            is given or the transformer is lazy, or `memory_policy` is
+            unknown.
+
+        MemoryError :
+            The result exceeds `max_memory` and `memory_policy` is 'error'.
+        """
+        if sparse.issparse(X):
+            if self.lazy or out is not None:
+                raise ValueError("Sparse matrices can not be transformed lazily or into out")
+            return self._transform(X)
+        X = np.asarray(X)
+        if self.lazy:
+            if out is not None:
+                raise ValueError("out can not be used with a lazy transformer")
+            return SumDiffMatrix(X.astype(self._result_dtype(X), copy=False),
+                                 columns=self._columns())
+        if out is None and self.max_memory is not None:
+            columns = self._columns()
+            m = X.shape[1] * X.shape[1] if columns is None else len(columns)
+            row_size = m * self._result_dtype(X).itemsize
+            size = X.shape[0] * row_size
+            if size > self.max_memory:
+                if self.memory_policy == 'error':
+                    raise MemoryError("The result of %d bytes exceeds max_memory of %d bytes"
+                                      % (size, self.max_memory))
+                elif self.memory_policy == 'memmap':
+                    out = _temporary_memmap([X.shape[0], m], self._result_dtype(X))
+                elif self.memory_policy == 'blocks':
+                    return self.transform_blocks(X, max(1, self.max_memory // max(row_size, 1)))
                 else:
-                    X_new[:, i * X.shape[1] + j] = X[:, i]
-        return X_new
+                    raise ValueError("Unknown memory policy: %s" % str(self.memory_policy))
+        return self._transform(X, out)
+
+    def _transform(self, X, out=None):
+        """
+        Computes the dense result of `transform` for a non-lazy transformer.
+        """
+        n, p = X.shape
+        columns = self._columns()
+        m = p * p if columns is None else len(columns)
+        if sparse.issparse(X):
+            if columns is None:
+                columns = np.arange(0, m)
+            dtype = self._result_dtype(X)
+            X_new = sparse.csr_matrix(X, dtype=dtype) @ _sum_diff_operator(p, columns, dtype)
+            X_new = sparse.csr_matrix(X_new)
+            # Equal values cancel out in differences.
+            X_new.eliminate_zeros()
+            return X_new
+        if out is None:
+            out = np.empty([n, m], dtype=self._result_dtype(X))
+        elif out.shape != (n, m) or not out.flags.c_contiguous:
+            raise ValueError("out must be a C-contiguous array of shape %s" % str((n, m)))
+        X = X.astype(out.dtype, copy=False)
+        if columns is not None:
+            parts = np.array_split(np.arange(0, m), min(effective_n_jobs(self.n_jobs), max(m, 1)))
+            Parallel(n_jobs=self.n_jobs, backend='threading')(
+                delayed(_fill_sum_diff_columns)(X, columns, part, out) for part in parts)
+            return out
+        blocks = out.reshape([n, p, p])
+        parts = np.array_split(np.arange(0, p), min(effective_n_jobs(self.n_jobs), max(p, 1)))
+        Parallel(n_jobs=self.n_jobs, backend='threading')(
+            delayed(_fill_sum_diff_blocks)(X, part, blocks) for part in parts)
+        return out
+
+    def transform_blocks(self, X, block_size=10000):
+        """
+        Does the same transformation as `transform`, but yields the result
+        in blocks of `block_size` rows, so only one block has to be kept in
+        memory at a time, e.g. to write it to disk or to feed it to a model
+        supporting incremental fitting.
+
+        Parameters
+        ----------
+        X : numpy.ndarray or scipy.sparse matrix
+            The source feature matrix.
+
+        block_size : int, default 10000
+            The number of rows in every block but possibly the last one.
+
+        Yields
+        ------
+        numpy.ndarray or scipy.sparse.csr_matrix :
+            The extended feature matrix for the next block of rows, a CSR
+            matrix for sparse `X` as `transform` returns. Dense for dense
+            `X` even if the transformer is lazy.
+        """
+        X = sparse.csr_matrix(X) if sparse.issparse(X) else np.asarray(X)
+        for start in range(0, X.shape[0], block_size):
+            yield self._transform(X[start:start + block_size])
@@ -17,6 +17,42 @@ Classed sefined here:
 import numpy as np
 import pandas as pd
 import warnings
+from functools import lru_cache
+
+# The titles `extract_title` may return and the words found in names
+# meaning each of them.
+_TITLE_WORDS = [
+    ("Mr", ["Mr"]),
+    ("Mrs", ["Mrs", "Mme"]),
+    ("Miss", ["Miss", "Ms", "Mlle"]),
+    ("Master", ["Master"]),
+    ("Dr", ["Dr"]),
+    ("Military", ["Capt", "Major", "Col"]),
+    ("Royal", ["Sir", "Count", "Countess"]),
+]
+
+@lru_cache(maxsize=None)
+def _title_codes(titles):
+    """
+    Builds the lookup table used by `extract_title`.
+
+    Parameters
+    ----------
+    titles : tuple
+        The interesting titles, see `extract_title`.
+
+    Returns
+    -------
+    dict :
+        Maps every word found in names to the index of its title in
+        `titles`. The words missing here mean the Rare title.
+    """
+    codes = {}
+    for title, words in _TITLE_WORDS:
+        if title in titles:
+            for word in words:
+                codes[word] = titles.index(title)
+    return codes
 
 def extract_title(data, titles=None):
     """
@@ -49,8 +85,8 @@ def extract_title(data, titles=None):
     Returns
     -------
     pandas.Series
-        The list of integers of range 0-4 (or `0` to `len (titles) - 1` if
-        `titles` argument given) indicating the titles taken from the name
+        The list of int8 integers of range 0-4 (or `0` to `len (titles) - 1`
+        if `titles` argument given) indicating the titles taken from the name
         column. The series index will be same with that of data argument.
 
     Raises
@@ -70,24 +106,35 @@ def extract_title(data, titles=None):
         warnings.warn("Using non-default title list is still an experimental feature and may change without deprecation")
     if 'Mr' not in titles or 'Mrs' not in titles or 'Miss' not in titles or 'Master' not in titles:
         raise Exception("Must be able to return Mr, Mrs, Miss and Master titles.")
-    def _mapper(x):
-        if x in ["Mr"]:
-            return titles.index("Mr")
-        elif x in ["Mrs", "Mme"]:
-            return titles.index("Mrs")
-        elif x in ["Miss", "Ms", "Mlle"]:
-            return titles.index("Miss")
-        elif x in ["Master"]:
-            return titles.index("Master")
-        elif x in ["Dr"] and "Dr" in titles:
-            return titles.index("Dr")
-        elif x in ["Capt", "Major", "Col"] and "Military" in titles:
-            return titles.index("Military")
-        elif x in ["Sir", "Count", "Countess"] and "Royal" in titles:
-            return titles.index("Royal")
-        else:
-            return titles.index("Rare")
-    return data.Name.str.extract("([A-Za-z]+)\\.", expand=False).map(_mapper)
+    codes = data.Name.str.extract("([A-Za-z]+)\\.", expand=False).map(_title_codes(tuple(titles)))
+    if codes.isna().any():
+        codes = codes.fillna(titles.index("Rare"))
+    return codes.astype(np.int8)
+
+def _other_outcomes(data, key):
+    """
+    Counts the other passengers sharing the value of a column with every
+    passenger that are known to survive or die.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        The Titanic data frame containing the `key` and Survived columns.
+
+    key : str
+        The name of the column grouping the passengers, e.g. Ticket.
+
+    Returns
+    -------
+    (pandas.Series, pandas.Series) :
+        The numbers of other passengers of the same group survived and
+        died. Both are NaN for the passengers with NaN in the `key` column.
+    """
+    survived = (data.Survived == 1).astype(np.int64)
+    died = (data.Survived == 0).astype(np.int64)
+    surv = survived.groupby(data[key]).transform("sum") - survived
+    died = died.groupby(data[key]).transform("sum") - died
+    return surv, died
 
 #
 # The functions used to calculate survival of the passenger's family members.
@@ -152,38 +199,21 @@ class TicketCounter(object):
         Adds the TicketCount and TicketRate columns to the `self.data` frame
         referring to the `data` argument of the constructor.
         """
-        counts = {}
-        surv = {}
-        died = {}
-        for t in self.data.Ticket.unique():
-            counts[t] = self.data[self.data.Ticket == t].PassengerId.count()
-            surv[t] = self.data[(self.data.Ticket == t) & (self.data.Survived == 1)].Survived.count()
-            died[t] = self.data[(self.data.Ticket == t) & (self.data.Survived == 0)].Survived.count()
-        self.data["TicketCount"] = self.data.Ticket.map(lambda x: counts[x])
-        self.data["TicketRate"] = np.NaN
-        for i in self.data.index:
-            ticket = self.data.loc[i, "Ticket"]
-            pid = self.data.loc[i, "PassengerId"]
-            if self.simplified:
-                if self.fill_if_not_any_survived:
-                    if self.data.loc[(self.data.Ticket == ticket) & (self.data.PassengerId != pid)].Survived.max() == 1.0:
-                        self.data.loc[i, "TicketRate"] = 1.0
-                    elif self.data.loc[(self.data.Ticket == ticket) & (self.data.PassengerId != pid)].Survived.min() == 0.0:
-                        self.data.loc[i, "TicketRate"] = 0.0
-                else:
-                    if self.data.loc[(self.data.Ticket == ticket) & (self.data.PassengerId != pid)].Survived.min() == 1.0:
-                        self.data.loc[i, "TicketRate"] = 1.0
-                    elif self.data.loc[(self.data.Ticket == ticket) & (self.data.PassengerId != pid)].Survived.max() == 0.0:
-                        self.data.loc[i, "TicketRate"] = 0.0
+        self.data["TicketCount"] = self.data.groupby("Ticket").PassengerId.transform("count")
+        surv, died = _other_outcomes(self.data, "Ticket")
+        if self.simplified:
+            # The other passengers all survived (or all died) exactly if
+            # there are survived (died) ones and no died (survived) ones.
+            rate = pd.Series(np.NaN, index=self.data.index)
+            if self.fill_if_not_any_survived:
+                rate[died > 0] = 0.0
+                rate[surv > 0] = 1.0
             else:
-                s = surv[self.data.loc[i, "Ticket"]]
-                d = died[self.data.loc[i, "Ticket"]]
-                if np.isfinite(self.data.loc[i].Survived) and (self.data.loc[i].Survived == 1):
-                    s -= 1
-                if np.isfinite(self.data.loc[i].Survived) and (self.data.loc[i].Survived == 0):
-                    d -= 1
-                if s + d:
-                    self.data.loc[i, "TicketRate"] = float(s) / float(s + d)
+                rate[(surv > 0) & (died == 0)] = 1.0
+                rate[(died > 0) & (surv == 0)] = 0.0
+        else:
+            rate = surv / (surv + died).where(surv + died > 0)
+        self.data["TicketRate"] = rate
         if self.simplified:
             self.data["TicketRate"] = self.data["TicketRate"].fillna(0.5)
         else:
@@ -255,46 +285,85 @@ class CabinCounter(object):
         Adds the CabinCount and CabinRate columns to the `self.data` data frame,
         that is a referrence to the `data` parameter of the constructor.
         """
-        counts = {}
-        surv = {}
-        died = {}
-        for c in self.data.loc[~self.data.Cabin.isna(), "Cabin"].unique():
-            counts[c] = self.data[self.data.Cabin == c].PassengerId.count()
-            surv[c] = self.data[(self.data.Cabin == c) & (self.data.Survived == 1)].Survived.count()
-            died[c] = self.data[(self.data.Cabin == c) & (self.data.Survived == 0)].Survived.count()
-        self.data.loc[self.data.Cabin.isna(), "CabinCount"] = 0
-        self.data.loc[~self.data.Cabin.isna(), "CabinCount"] = self. data.loc[~self.data.Cabin.isna(), "Cabin"].map(lambda x: counts[x])
-        self.data["CabinRate"] = np.NaN
-        for i in self.data.index:
-            if not self.data.loc[i, "Cabin"] in counts:
-                continue
-            cabin = self.data.loc[i, "Cabin"]
-            pid = self.data.loc[i, "PassengerId"]
-            if self.simplified:
-                if self.data.loc[(self.data.Cabin == cabin) & (self.data.PassengerId != pid)].Survived.min() == 1.0:
-                    self.data.loc[i, "CabinRate"] = 1.0
-                elif self.data.loc[(self.data.Cabin == cabin) & (self.data.PassengerId != pid)].Survived.max() == 0.0:
-                    self.data.loc[i, "CabinRate"] = 0.0
-            else:
-                s = surv[cabin]
-                d = died[cabin]
-                if np.isfinite(self.data.loc[i].Survived) and (self.data.loc[i].Survived == 1):
-                    s -= 1
-                if np.isfinite(self.data.loc[i].Survived) and (self.data.loc[i].Survived == 0):
-                    d -= 1
-                if s + d:
-                    self.data.loc[i, "CabinRate"] = float(s) / float(s + d)
-        self.data.loc[self.data.CabinRate.isna(), "CabinRate"] = self.filler.loc[self.data.CabinRate.isna()]
+        counts = self.data.groupby("Cabin").PassengerId.transform("count")
+        self.data["CabinCount"] = counts.fillna(0).astype(np.float64)
+        # Both are NaN for passengers with no cabin, so their rate is NaN.
+        surv, died = _other_outcomes(self.data, "Cabin")
+        if self.simplified:
+            rate = pd.Series(np.NaN, index=self.data.index)
+            rate[(surv > 0) & (died == 0)] = 1.0
+            rate[(died > 0) & (surv == 0)] = 0.0
+        else:
+            rate = surv / (surv + died).where(surv + died > 0)
+        self.data["CabinRate"] = rate.fillna(self.filler)
+
+class _DisjointSets(object):
+    """
+    A disjoint-set forest (union-find) over integers from 0 to `n - 1`.
+    """
+
+    def __init__(self, n):
+        """
+        Initialize the forest of `n` single-element sets.
+        """
+        self.parent = list(range(n))
+
+    def find(self, i):
+        """
+        Returns the root of the set containing `i`, halving the path to it.
+        """
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i, j):
+        """
+        Unites the sets containing `i` and `j`. The root of the set
+        containing `j` becomes the root of the united set.
+        """
+        i = self.find(i)
+        j = self.find(j)
+        if i != j:
+            self.parent[i] = j
+
+    def roots(self):
+        """
+        Returns the numpy array of roots of the sets containing every element.
+        """
+        return np.array([self.find(i) for i in range(len(self.parent))], dtype=np.int64)
 
 class FamilyPredictor(object):
     """
     Object used to add family survival information to Titanic dataset.
     """
 
+    def _family_key(self, i):
+        """
+        Returns the key of the family registry for the passenger with index `i`.
+
+        Parameters
+        ----------
+        i : int
+            Index of a passenger in `self.data` frame.
+
+        Returns
+        -------
+        tuple or None :
+            The (Pclass, Embarked, Lastname) tuple of the passenger, or None
+            if any of them is NaN. Such a passenger never joins an existing
+            family group since NaN never equals anything.
+        """
+        key = (self.data.loc[i, "Pclass"], self.data.loc[i, "Embarked"], self.data.loc[i, "Lastname"])
+        if any(pd.isna(k) for k in key):
+            return None
+        return key
+
     def _new_family(self, i):
         """
-        Add a new family group to the `self.families` list and place the passenger
-        with index `i` to that group.
+        Add a new family group to the `self._families` registry and place the
+        passenger with index `i` to that group.
 
         Parameters
         ----------
@@ -312,12 +381,14 @@ class FamilyPredictor(object):
             The index of the new family group. It should then be assinged
             to `self.data.Family[i]` to add the passenger to the new goup.
         """
-        idx = len(self.families)
-        self.families.loc[idx,'Pclass'] = self.data.loc[i, "Pclass"]
-        self.families.loc[idx,'Embarked'] = self.data.loc[i, "Embarked"]
-        self.families.loc[idx,'Lastname'] = self.data.loc[i, "Lastname"]
-        self.families.loc[idx,'Size'] = 0
-        self.families.loc[idx,'Id'] = idx
+        idx = len(self._families["Id"])
+        for column in ["Pclass", "Embarked", "Lastname"]:
+            self._families[column].append(self.data.loc[i, column])
+        self._families["Size"].append(0)
+        self._families["Id"].append(idx)
+        key = self._family_key(i)
+        if key is not None:
+            self._family_index.setdefault(key, idx)
         return idx
 
     def _find_family(self, i):
@@ -338,19 +409,10 @@ class FamilyPredictor(object):
             just created family group. The `Family` column for the passenger will
             not be updated, it still should be done separately.
         """
-        fams = self.families.loc[(self.families.Pclass == self.data.loc[i, "Pclass"]) & (self.families.Embarked == self.data.loc[i, "Embarked"])]
-        if not len(fams):
-            return self._new_family(i)
-        exact = fams.loc[fams.Lastname == self.data.loc[i, "Lastname"]]
-        if len(exact):
-            return exact.iloc[0].Id
-        if self.data.loc[i, "SecondaryLastname"] == np.NaN:
-            return self._new_family(i)
-        secondary = fams.loc[fams.Lastname == self.data.loc[i, "SecondaryLastname"]]
-        if len(exact):
-            return exact.iloc[0].Id
-        else:
-            return self._new_family(i)
+        key = self._family_key(i)
+        if key in self._family_index:
+            return self._family_index[key]
+        return self._new_family(i)
 
     def _fill_family_ids(self):
         """
@@ -360,60 +422,135 @@ class FamilyPredictor(object):
         self.families = pd.DataFrame(columns=['Pclass', 'Embarked', 'Lastname', 'Id', 'Size'])
         self.data["Family"] = np.NaN
         if self.use_fare:
-            self.data["Family"] = np.NaN
-            fid = 0
-            for i in self.data.index:
-                f = self.data.loc[i].Fare
-                l = self.data.loc[i].Lastname
-                if np.isfinite(self.data.loc[i].Family):
-                    continue
-                self.data.loc[(self.data.Fare == f) & (self.data.Lastname == l), "Family"] = fid
-                fid += 1
+            keys = self.data[["Fare", "Lastname"]]
+            known = keys.notna().all(axis=1).values
+            groups = self.data.groupby(["Fare", "Lastname"], sort=self.sort_families).ngroup()
+            ids = groups.values[known].astype(np.int64)
+            if not self.sort_families:
+                # Number the families as the passengers were searched row by
+                # row before: every row with NaN Fare or Lastname took an ID
+                # of its own without being assigned it.
+                first = known & ~keys.duplicated().values
+                ids = (np.cumsum(first | ~known) - 1)[first][ids]
+            family = np.full(len(self.data), np.NaN)
+            family[known] = ids
+            self.data["Family"] = family
         else:
-            for i in self.data.index:
-                # Leave family ID NAN if no family.
-                if self.data.loc[i, "SibSp"] == 0 and self.data.loc[i, "Parch"] == 0:
-                    continue
-                self.data.loc[i, "Family"] = self._find_family(i)
-                f = self.data.loc[i, "Family"]
-                self.families.loc[self.families.Id == f, "Size"] = self.families.loc[self.families.Id == f, "Size"] + 1
-            for f in self.families.index:
-                if self.families.loc[f].Size != 1:
-                    continue
-                fid = self.families.loc[f].Id
-                pid = self.data.loc[self.data.Family == fid, "PassengerId"].iloc[0]
-                pclass = self.data.loc[self.data.Family == fid, "Pclass"].iloc[0]
-                emb = self.data.loc[self.data.Family == fid, "Embarked"].iloc[0]
-                second_name = self.data.loc[self.data.Family == fid, "SecondaryLastname"].iloc[0]
-                if second_name == np.NaN:
-                    continue
-                fams = self.families.loc[self.families.Lastname == second_name]
-                for fam in fams.index:
-                    fam_id = fams.loc[fam].Id
-                    c = self.data.loc[self.data.Family == fid, "Family"].count()
-                    self.families.loc[self.families.Id == fam_id, "Size"] = self.families.loc[self.families.Id == fam_id, "Size"] + c
-                    self.data.loc[self.data.Family == fid, "Family"] = fam_id
-                    self.families.loc[f, "Size"] = 0
-                    break
-                if self.families.loc[f, "Size"] == 0:
+            # The family groups are registered in plain lists indexed by
+            # family ID and a dict mapping the (Pclass, Embarked, Lastname)
+            # key to the first family ID with that key.
+            self._families = {c: [] for c in self.families.columns}
+            self._family_index = {}
+            family = np.full(len(self.data), np.NaN)
+            # Leave family ID NAN if no family.
+            alone = ((self.data.SibSp == 0) & (self.data.Parch == 0)).values
+            for pos, i in enumerate(self.data.index):
+                if alone[pos]:
                     continue
-                if self.data.loc[self.data.PassengerId == pid, "SibSp"].iloc[0] == 0:
-                    continue
-                if self.data.loc[self.data.PassengerId == pid, "Sex"].iloc[0] != 1:
-                    continue
-                sisters = self.data.loc[(self.data.SecondaryLastname == second_name) &
-                                        (self.data.Sex == 'female') &
-                                        (self.data.Pclass == pclass) &
-                                        (self.data.Embarked == emb) &
-                                        (self.data.PassengerId != pid)]
-                if len(sisters) > 0:
-                    fam_id = sisters.iloc[0].Family
-                    c = self.data.loc[self.data.Family == fid, "Family"].count()
-                    self.families.loc[self.families.Id == fam_id, "Size"] = self.families.loc[self.families.Id == fam_id, "Size"] + c
-                    self.data.loc[data.Family == fid, "Family"] = fam_id
-                    self.families.loc[f, "Size"] = 0
-
-    def __init__(self, data, filler=None, simplified=False, use_fare=False, fill_if_not_any_survived=False):
+                family[pos] = f = self._find_family(i)
+                self._families["Size"][f] += 1
+            self.data["Family"] = family
+            self.families = pd.DataFrame(self._families, columns=self.families.columns)
+            self._merge_families()
+
+    def _merge_families(self):
+        """
+        Merges the family groups with a single member into other family groups.
+
+        Every rule below links the lone members of family groups to other
+        groups, all the links found at once by vectorized operations. By
+        default, the groups are then visited in order of their IDs, and the
+        member of a group still having a single member is moved to the group
+        it is linked to, so a lone member linked to another lone member only
+        joins the latter, and that group is not merged any more. If
+        `merge_transitively` is True, the linked groups are united by
+        a disjoint-set forest instead, so links are transitive: a lone member
+        linked to another lone member joins the group the latter is linked to.
+
+        *   A member whose secondary last name (e.g. the maiden name of
+            a married woman) is the last name of a family group is linked
+            to the first such group.
+
+        *   If `link_sisters` is True, a woman with siblings aboard not
+            linked by her secondary last name is linked to the family group
+            of the first other woman with same secondary last name, Pclass
+            and Embarked values.
+
+        The merged groups keep their rows in `self.families` with zero size.
+        """
+        families = self.families
+        singles = families.Id[families.Size == 1].values.astype(np.float64)
+        members = self.data.loc[self.data.Family.isin(singles)]
+        named = families.dropna(subset=["Lastname"]).drop_duplicates("Lastname")
+        targets = members.SecondaryLastname.map(pd.Series(named.Id.values, index=named.Lastname.values))
+        linked = targets.notna()
+        sources = [members.Family[linked].values]
+        dests = [targets[linked].values]
+        if self.link_sisters:
+            keys = ["SecondaryLastname", "Pclass", "Embarked"]
+            lone = members.loc[~linked & (members.SibSp > 0) & (members.Sex == "female"), keys + ["PassengerId", "Family"]]
+            women = self.data.loc[(self.data.Sex == "female") & self.data.Family.notna(), keys + ["PassengerId", "Family"]]
+            women = women.assign(Row=np.flatnonzero(self.data.index.isin(women.index)))
+            sisters = lone.merge(women.dropna(subset=["SecondaryLastname"]), on=keys, suffixes=("", "Sister"))
+            sisters = sisters.loc[sisters.PassengerId != sisters.PassengerIdSister].drop_duplicates("PassengerId")
+            sources.append(sisters.Family.values)
+            dests.append(sisters.FamilySister.values)
+        if not self.merge_transitively:
+            # The sister links are followed to the current family of the
+            # sister, which may change while merging.
+            sister_rows = dict(zip(sisters.Family.values.astype(np.int64), sisters.Row.values)) \
+                if self.link_sisters else {}
+            self._merge_in_order(dict(zip(sources[0].astype(np.int64), dests[0].astype(np.int64))),
+                                 sister_rows)
+            return
+        forest = _DisjointSets(len(families))
+        for i, j in zip(np.concatenate(sources).astype(np.int64), np.concatenate(dests).astype(np.int64)):
+            forest.union(i, j)
+        known = self.data.Family.notna()
+        family = forest.roots()[self.data.Family[known].values.astype(np.int64)]
+        self.data.loc[known, "Family"] = family
+        self.families["Size"] = np.bincount(family, minlength=len(families))
+
+    def _merge_in_order(self, targets, sister_rows):
+        """
+        Visits the family groups in order of their IDs and moves the member
+        of every group still having a single member to the group it is
+        linked to, see `_merge_families`.
+
+        Parameters
+        ----------
+        targets : dict
+            Maps IDs of family groups to IDs of the groups they are linked to
+            by the secondary last name of their member.
+
+        sister_rows : dict
+            Maps IDs of family groups not in `targets` to the positions in
+            `self.data` of the sisters of their members.
+        """
+        family = self.data.Family.values.copy()
+        sizes = self.families.Size.values.copy()
+        rows = {}
+        for pos in np.flatnonzero(~np.isnan(family)):
+            rows.setdefault(int(family[pos]), []).append(pos)
+        for f in range(0, len(sizes)):
+            if sizes[f] != 1:
+                continue
+            if f in targets:
+                target = targets[f]
+            elif f in sister_rows:
+                target = int(family[sister_rows[f]])
+            else:
+                continue
+            moved = rows.pop(f, [])
+            family[moved] = target
+            rows.setdefault(target, []).extend(moved)
+            sizes[target] += len(moved)
+            sizes[f] = 0
+        self.data["Family"] = family
+        self.families["Size"] = sizes
+
+    def __init__(self, data, filler=None, simplified=False, use_fare=False, fill_if_not_any_survived=False,
+                 link_sisters=False, sort_families=False, merge_transitively=False):
         """
         Initializes a FamilyPredictor object.
 
@@ -471,11 +608,34 @@ class FamilyPredictor(object):
             by S.Xu,
             `https://www.kaggle.com/danspace/titanic-knn`
             by Diane Yuan and a number of other kernels.
+
+        link_sisters : boolean, default False
+            Only used if `use_fare` is False. Whether to add lone women
+            with siblings aboard to the family of a woman with the same
+            secondary last name, class and port of embarkation, likely
+            their sister.
+
+        sort_families : boolean, default False
+            Only used if `use_fare` is True. Whether to number the families
+            in order of their Fare and Lastname values rather than in order
+            of their first appearance in `data`. The grouping is the same,
+            but sorting spares a pass over the data.
+
+        merge_transitively : boolean, default False
+            Only used if `use_fare` is False. Whether to merge the lone
+            family members transitively, e.g. a lone member whose secondary
+            last name is the last name of another lone member, joins the
+            family the latter joins. By default the lone members are merged
+            one by one in order of their family IDs, which only moves the
+            former to the family of the latter, see `_merge_families`.
         """
         self.data = data
         self.simplified = simplified
         self.use_fare = use_fare
         self.fill_if_not_any_survived = fill_if_not_any_survived
+        self.link_sisters = link_sisters
+        self.sort_families = sort_families
+        self.merge_transitively = merge_transitively
         if 'Lastname' not in list(self.data.columns):
             self.data['Lastname'] = self.data['Name'].apply(lambda x: str.split(x, ",")[0])
         if 'SecondaryLastname' not in list(self.data.columns):
@@ -4,14 +4,42 @@ Unit tests for `ai_kaggletools.select_features` module.
 
 from unittest import TestCase
 
+import os
+import shutil
+import tempfile
+
 import numpy as np
 import pandas as pd
 
+from scipy import sparse
+
 from sklearn.linear_model import LinearRegression
+from sklearn.linear_model import Ridge
+from sklearn.tree import DecisionTreeRegressor
 
 from kaggletools.select_features import select_features_ascending
 from kaggletools.select_features import select_features_descending
 from kaggletools.select_features import SumDiffTransformer
+from kaggletools.select_features import SumDiffMatrix
+from kaggletools.select_features import ScoreCache
+from kaggletools.select_features import squash_rare
+from kaggletools.select_features import squash_rare_columns
+from kaggletools.select_features import RareCategorySquasher
+from kaggletools.select_features import _CVScorer
+from kaggletools.select_features import _LinearCV
+
+import pickle
+
+class CountingRegression(LinearRegression):
+    """
+    Linear regression counting how many times it was fitted.
+    """
+
+    fits = 0
+
+    def fit(self, X, y, *args, **kwargs):
+        CountingRegression.fits += 1
+        return super(CountingRegression, self).fit(X, y, *args, **kwargs)
 
 class TestAscending(TestCase):
     """
@@ -30,8 +58,9 @@ class TestAscending(TestCase):
                          columns=["A", "B", "C", "D", "E", "F"])
         y = X["A"] + X["C"] + X["E"]
         model = LinearRegression()
-        features = select_features_ascending(X, y, model)
-        self.assertCountEqual(features, ["A", "C", "E"])
+        for engine in ['cv', 'linear']:
+            features = select_features_ascending(X, y, model, engine=engine)
+            self.assertCountEqual(features, ["A", "C", "E"])
 
     def test_normal_linear_with_starting_features(self):
         """
@@ -63,6 +92,157 @@ class TestAscending(TestCase):
         features = select_features_ascending(X, y, model, n_jobs=-1)
         self.assertCountEqual(features, ["A", "C", "E"])
 
+    def test_parallel_temp_folder(self):
+        """
+        A parallel run must select the same features as a sequential one
+        and remove the temporary folder of the shared data matrix.
+        """
+        rng = np.random.RandomState(0)
+        X = pd.DataFrame(rng.randn(1000, 6),
+                         columns=["A", "B", "C", "D", "E", "F"])
+        y = X["A"] + 0.5 * X["C"] + 0.25 * X["E"] + rng.randn(1000) * 0.1
+        model = LinearRegression()
+        expected = select_features_ascending(X, y, model)
+        folder = tempfile.mkdtemp()
+        previous = os.environ.get("JOBLIB_TEMP_FOLDER")
+        os.environ["JOBLIB_TEMP_FOLDER"] = folder
+        try:
+            features = select_features_ascending(X, y, model, n_jobs=2)
+            leftovers = [name for name in os.listdir(folder) if name.startswith("kaggletools_")]
+        finally:
+            if previous is None:
+                del os.environ["JOBLIB_TEMP_FOLDER"]
+            else:
+                os.environ["JOBLIB_TEMP_FOLDER"] = previous
+            shutil.rmtree(folder)
+        self.assertListEqual(features, expected)
+        self.assertListEqual(leftovers, [])
+
+    def test_linear_engine(self):
+        """
+        The closed-form linear engine must select the same features
+        as the cross_validate-based one, also for ridge models.
+        """
+        rng = np.random.RandomState(0)
+        X = pd.DataFrame(rng.randn(1000, 6),
+                         columns=["A", "B", "C", "D", "E", "F"])
+        y = X["A"] + 0.5 * X["C"] + 0.25 * X["E"] + rng.randn(1000) * 0.1
+        for model in [LinearRegression(), Ridge(alpha=10.0)]:
+            expected = select_features_ascending(X, y, model)
+            features = select_features_ascending(X, y, model, engine='linear')
+            self.assertListEqual(features, expected)
+        expected = select_features_ascending(X, y, LinearRegression(),
+                                             starting_features=["D"])
+        features = select_features_ascending(X, y, LinearRegression(),
+                                             starting_features=["D"],
+                                             engine='linear')
+        self.assertListEqual(features, expected)
+        self.assertListEqual(features[:4], ["D", "A", "C", "E"])
+
+    def test_linear_engine_scores(self):
+        """
+        The linear engine must return the same scores as fitting the
+        models does, up to rounding errors.
+        """
+        rng = np.random.RandomState(0)
+        X = rng.randn(300, 5)
+        y = X[:, 0] + 0.5 * X[:, 2] + rng.randn(300) * 0.1
+        for model in [LinearRegression(), Ridge(alpha=10.0)]:
+            scorer = _CVScorer(model, X, y)
+            linear = _LinearCV(X, y, model)
+            linear.start([0, 2])
+            np.testing.assert_allclose(linear.scores(),
+                                       scorer.scores([[0, 2]])[:, 0],
+                                       rtol=1e-8)
+            np.testing.assert_allclose(linear.add_scores([1, 3, 4]),
+                                       scorer.scores([[0, 1, 2], [0, 2, 3], [0, 2, 4]]),
+                                       rtol=1e-8)
+            np.testing.assert_allclose(linear.remove_scores(),
+                                       scorer.scores([[2], [0]]),
+                                       rtol=1e-8)
+
+    def test_linear_engine_duplicated_column(self):
+        """
+        The linear engine must not fail on a singular Gram matrix of the
+        starting features.
+        """
+        rng = np.random.RandomState(0)
+        X = pd.DataFrame(rng.randn(1000, 4), columns=["A", "B", "C", "D"])
+        X["A2"] = X["A"]
+        y = X["A"] + X["C"] + rng.randn(1000) * 0.1
+        features = select_features_ascending(X, y, LinearRegression(),
+                                             starting_features=["A", "A2"],
+                                             engine='linear')
+        self.assertListEqual(features[:2], ["A", "A2"])
+        self.assertIn("C", features)
+
+    def test_racing(self):
+        """
+        Racing must select the same features in a clear case while
+        fitting fewer models.
+        """
+        rng = np.random.RandomState(0)
+        X = pd.DataFrame(rng.randn(1000, 8),
+                         columns=["A", "B", "C", "D", "E", "F", "G", "H"])
+        y = X["A"] + X["C"] + X["E"] + rng.randn(1000) * 0.1
+        CountingRegression.fits = 0
+        expected = select_features_ascending(X, y, CountingRegression())
+        fits = CountingRegression.fits
+        CountingRegression.fits = 0
+        features = select_features_ascending(X, y, CountingRegression(), racing=True)
+        self.assertCountEqual(features, expected)
+        self.assertLess(CountingRegression.fits, fits)
+
+    def test_subsample(self):
+        """
+        Pre-scoring the candidates on row subsamples must select the
+        same features in a clear case. The target has no noise, so no
+        other feature can improve the score.
+        """
+        rng = np.random.RandomState(0)
+        X = pd.DataFrame(rng.randn(4000, 8),
+                         columns=["A", "B", "C", "D", "E", "F", "G", "H"])
+        y = X["A"] + X["C"] + X["E"]
+        model = LinearRegression()
+        features = select_features_ascending(X, y, model, subsample=[0.05, 0.25])
+        self.assertCountEqual(features, ["A", "C", "E"])
+        with self.assertRaises(ValueError):
+            select_features_ascending(X, y, model, subsample=[1.5])
+
+    def test_budget(self):
+        """
+        A selector running out of its budget must stop and return the
+        features selected by the last completed step.
+        """
+        rng = np.random.RandomState(0)
+        X = pd.DataFrame(rng.randn(1000, 6),
+                         columns=["A", "B", "C", "D", "E", "F"])
+        y = X["A"] + X["C"] + X["E"]
+        model = LinearRegression()
+        # The first step takes 60 evaluations, the second one 50.
+        features, evaluations = select_features_ascending(X, y, model,
+                                                          max_evaluations=70,
+                                                          return_evaluations=True)
+        self.assertEqual(evaluations, 70)
+        self.assertEqual(len(features), 1)
+        self.assertIn(features[0], ["A", "C", "E"])
+        features, evaluations = select_features_ascending(X, y, model,
+                                                          starting_features=["D"],
+                                                          max_time=0,
+                                                          return_evaluations=True)
+        self.assertListEqual(features, ["D"])
+        self.assertEqual(evaluations, 0)
+
+    def test_linear_engine_unsupported_model(self):
+        """
+        The linear engine refuses to score non-linear models.
+        """
+        rng = np.random.RandomState(0)
+        X = pd.DataFrame(rng.randn(100, 2), columns=["A", "B"])
+        y = X["A"]
+        with self.assertRaises(ValueError):
+            select_features_ascending(X, y, DecisionTreeRegressor(), engine='linear')
+
 class TestDescending(TestCase):
     """
     Unit tests for `ai_kaggletools.select_features.select_features_descending`
@@ -84,6 +264,244 @@ class TestDescending(TestCase):
         features = select_features_descending(X, y, model)
         self.assertCountEqual(features, ["A", "C", "E"])
 
+    def test_linear_engine(self):
+        """
+        The linear engine must remove the same features as the
+        cross_validate-based one, also for ridge models.
+        """
+        rng = np.random.RandomState(0)
+        X = pd.DataFrame(rng.randn(2000, 6),
+                         columns=["A", "B", "C", "D", "E", "F"])
+        y = X["A"] + 0.5 * X["C"] + 0.25 * X["E"] + rng.randn(2000) * 0.1
+        for model in [LinearRegression(), Ridge(alpha=10.0)]:
+            expected = select_features_descending(X, y, model)
+            features = select_features_descending(X, y, model, engine='linear')
+            self.assertListEqual(features, expected)
+
+    def test_linear_engine_duplicated_column(self):
+        """
+        The linear engine must not fail on a singular Gram matrix of all
+        the features.
+        """
+        rng = np.random.RandomState(0)
+        X = pd.DataFrame(rng.randn(1000, 4), columns=["A", "B", "C", "D"])
+        X["A2"] = X["A"]
+        y = X["A"] + X["C"] + rng.randn(1000) * 0.1
+        features = select_features_descending(X, y, LinearRegression(), engine='linear')
+        self.assertIn("C", features)
+        self.assertTrue("A" in features or "A2" in features)
+
+    def test_normal_linear_with_njobs(self):
+        """
+        Fitting candidates in parallel must not change the result.
+        """
+        rng = np.random.RandomState(0)
+        X = pd.DataFrame(rng.randn(1000, 6),
+                         columns=["A", "B", "C", "D", "E", "F"])
+        y = X["A"] + 0.5 * X["C"] + 0.25 * X["E"] + rng.randn(1000) * 0.1
+        model = LinearRegression()
+        expected = select_features_descending(X, y, model)
+        features = select_features_descending(X, y, model, n_jobs=-1)
+        self.assertListEqual(features, expected)
+
+class TestScoreCache(TestCase):
+    """
+    Tests for the `ScoreCache` class used by both selectors.
+    """
+
+    def setUp(self):
+        """
+        Create a temporary folder for the cache file.
+        """
+        self.folder = tempfile.mkdtemp()
+        self.filename = os.path.join(self.folder, "scores.sqlite")
+
+    def tearDown(self):
+        """
+        Remove the temporary folder.
+        """
+        shutil.rmtree(self.folder)
+
+    def test_rerun_uses_cache(self):
+        """
+        A second run with the same cache file must select the same features
+        without fitting any model, and a descending run after an ascending
+        one must reuse its scores.
+        """
+        rng = np.random.RandomState(0)
+        X = pd.DataFrame(rng.randn(500, 4),
+                         columns=["A", "B", "C", "D"])
+        y = X["A"] + X["C"] + rng.randn(500) * 0.1
+        CountingRegression.fits = 0
+        expected = select_features_ascending(X, y, CountingRegression(), cache=self.filename)
+        self.assertGreater(CountingRegression.fits, 0)
+        CountingRegression.fits = 0
+        features = select_features_ascending(X, y, CountingRegression(), cache=self.filename)
+        self.assertListEqual(features, expected)
+        self.assertEqual(CountingRegression.fits, 0)
+        # Scoring all features and all subsets of 3 of them takes 50 fits
+        # without the cache, but a few of them were scored already.
+        with ScoreCache(self.filename) as cache:
+            select_features_descending(X, y, CountingRegression(), cache=cache)
+        self.assertLess(CountingRegression.fits, 50)
+
+    def test_other_data_not_reused(self):
+        """
+        Scores computed on other data must not be reused.
+        """
+        rng = np.random.RandomState(0)
+        X = pd.DataFrame(rng.randn(500, 3), columns=["A", "B", "C"])
+        y = X["A"] + rng.randn(500) * 0.1
+        select_features_ascending(X, y, CountingRegression(), cache=self.filename)
+        CountingRegression.fits = 0
+        select_features_ascending(X, y * 2, CountingRegression(), cache=self.filename)
+        self.assertGreater(CountingRegression.fits, 0)
+
+class TestSquashRare(TestCase):
+    """
+    Tests for the `squash_rare` function.
+    """
+
+    def test_simple(self):
+        """
+        Categories encountered less than `threshold` times are squashed.
+        """
+        data = pd.DataFrame({"A": ["x", "y", "x", "z", "x", "y", "w"]})
+        squash_rare(data, "A", threshold=2)
+        self.assertListEqual(list(data.A), ["x", "y", "x", "Rare", "x", "y", "Rare"])
+
+    def test_integers(self):
+        """
+        Integer categories are squashed into an integer one.
+        """
+        data = pd.DataFrame({"A": [1, 2, 1, 3, 1, 2]})
+        squash_rare(data, "A", threshold=3, rare_val=-1)
+        self.assertListEqual(list(data.A), [1, -1, 1, -1, 1, -1])
+
+    def test_missing(self):
+        """
+        Missing values are squashed only if they are rare.
+        """
+        data = pd.DataFrame({"A": ["x", np.NaN, "x", "y", "x", np.NaN]})
+        squash_rare(data, "A", threshold=2)
+        self.assertListEqual(list(data.A.fillna("missing")),
+                             ["x", "missing", "x", "Rare", "x", "missing"])
+        data = pd.DataFrame({"A": ["x", np.NaN, "x", "y", "x", "y"]})
+        squash_rare(data, "A", threshold=2)
+        self.assertListEqual(list(data.A), ["x", "Rare", "x", "y", "x", "y"])
+
+    def test_categorical(self):
+        """
+        A categorical column must be squashed the same way as an object one
+        and stay categorical.
+        """
+        data = pd.DataFrame({"A": pd.Categorical(["x", "x", "y", "z"])})
+        squash_rare(data, "A", threshold=2)
+        self.assertListEqual(list(data.A), ["x", "x", "Rare", "Rare"])
+        self.assertListEqual(list(data.A.cat.categories), ["x", "Rare"])
+        data = pd.DataFrame({"A": ["x", "x", "y", "z"]})
+        squash_rare_columns(data, ["A"], threshold=1)
+        squash_rare(data, "A", threshold=2)
+        self.assertListEqual(list(data.A), ["x", "x", "Rare", "Rare"])
+
+class TestSquashRareColumns(TestCase):
+    """
+    Tests for the `squash_rare_columns` function.
+    """
+
+    def test_same_as_squash_rare(self):
+        """
+        Every column must be squashed as `squash_rare` does, using its
+        own threshold, but into a categorical column.
+        """
+        data = pd.DataFrame({"A": ["x", "y", "x", "z", "x", "y", np.NaN],
+                             "B": ["u", "u", "v", "v", "v", np.NaN, np.NaN],
+                             "C": [1, 2, 3, 4, 5, 6, 7]})
+        expected = data.copy()
+        defaulted = data.copy()
+        squash_rare(expected, "A", threshold=2)
+        squash_rare(expected, "B", threshold=3)
+        squash_rare_columns(data, ["A", "B"], threshold={"A": 2, "B": 3})
+        squash_rare_columns(defaulted, ["A", "B"], threshold={"A": 2}, default_threshold=3)
+        self.assertTrue(defaulted.equals(data))
+        self.assertEqual(data.A.dtype.name, "category")
+        self.assertEqual(data.B.dtype.name, "category")
+        self.assertListEqual(list(data.A), list(expected.A))
+        self.assertListEqual(list(data.B.astype(object)), list(expected.B))
+        self.assertListEqual(list(data.C), [1, 2, 3, 4, 5, 6, 7])
+
+class TestRareCategorySquasher(TestCase):
+    """
+    Tests for the `RareCategorySquasher` class.
+    """
+
+    def test_fit_transform(self):
+        """
+        Categories rare in the training data are squashed in any data,
+        the same way as `squash_rare` does for the training data.
+        """
+        train = pd.DataFrame({"A": ["x", "y", "x", "z", "x", "y", "w"],
+                              "B": [1, 1, 2, 2, 3, 1, 2]})
+        squasher = RareCategorySquasher(columns=["A"], threshold=2)
+        expected = train.copy()
+        squash_rare(expected, "A", threshold=2)
+        self.assertTrue(squasher.fit_transform(train).equals(expected))
+        self.assertListEqual(list(train.A), ["x", "y", "x", "z", "x", "y", "w"])
+        test = pd.DataFrame({"A": ["z", "x", "v", "y"], "B": [3, 3, 3, 3]})
+        squashed = pickle.loads(pickle.dumps(squasher)).transform(test)
+        self.assertListEqual(list(squashed.A), ["Rare", "x", "Rare", "y"])
+        self.assertListEqual(list(squashed.B), [3, 3, 3, 3])
+
+    def test_categorical(self):
+        """
+        Categorical columns, e.g. squashed by `squash_rare_columns`, must be
+        squashed the same way as object ones and stay categorical.
+        """
+        train = pd.DataFrame({"A": ["x", "x", "y", "z"]})
+        test = pd.DataFrame({"A": ["y", "x", "w"]})
+        squasher = RareCategorySquasher(threshold=2).fit(train)
+        expected = squasher.transform(test)
+        squash_rare_columns(test, ["A"], threshold=1)
+        squashed = squasher.transform(test)
+        self.assertEqual(squashed.A.dtype.name, "category")
+        self.assertListEqual(list(squashed.A), list(expected.A))
+        self.assertListEqual(list(squashed.A.cat.categories), ["x", "Rare"])
+
+    def test_fitted_state_size(self):
+        """
+        The pickled fitted squasher must not grow with the number of
+        rare categories.
+        """
+        sizes = []
+        for n in [10, 10000]:
+            data = pd.DataFrame({"A": ["x"] * 200 + ["v%d" % i for i in range(0, n)]})
+            squasher = RareCategorySquasher(threshold=100).fit(data)
+            self.assertFalse(hasattr(squasher, "counts_"))
+            sizes.append(len(pickle.dumps(squasher)))
+        self.assertEqual(sizes[0], sizes[1])
+
+    def test_chunks(self):
+        """
+        Counting categories chunk by chunk must give the same result as
+        counting them at once, and the sketch must keep heavy hitters.
+        """
+        values = np.random.RandomState(0).randint(0, 1000, 20000)
+        # Values 0, 1 and 2 are heavy hitters, all the others are rare.
+        values[::3] = 0
+        values[1::5] = 1
+        values[2::7] = 2
+        data = pd.DataFrame({"A": values})
+        expected = RareCategorySquasher(threshold=100).fit(data)
+        streamed = RareCategorySquasher(threshold=100)
+        sketched = RareCategorySquasher(threshold=100, max_categories=20)
+        for start in range(0, len(data), 3000):
+            streamed.partial_fit(data[start:start + 3000])
+            sketched.partial_fit(data[start:start + 3000])
+        self.assertCountEqual(streamed.frequent_["A"], expected.frequent_["A"])
+        self.assertCountEqual(sketched.frequent_["A"], [0, 1, 2])
+        self.assertLessEqual(len(sketched.counts_["A"]), 20)
+        self.assertTrue(sketched.transform(data).equals(expected.transform(data)))
+
 class TestSumDiff(TestCase):
     """
     Tests for the `SumDiffTransformer` class.
@@ -104,3 +522,143 @@ class TestSumDiff(TestCase):
                                [4, 5, 6]]).T
         self.assertAlmostEqual((X - X_expected).min(), 0.0)
         self.assertAlmostEqual((X - X_expected).max(), 0.0)
+
+    def test_layout(self):
+        """
+        Check the column layout on a wider random matrix.
+        """
+        rng = np.random.RandomState(0)
+        X = rng.randn(20, 7)
+        X_new = SumDiffTransformer().fit_transform(X)
+        self.assertEqual(X_new.shape, (20, 49))
+        for i in range(0, 7):
+            for j in range(0, 7):
+                if i > j:
+                    expected = X[:, i] + X[:, j]
+                elif i < j:
+                    expected = X[:, i] - X[:, j]
+                else:
+                    expected = X[:, i]
+                self.assertTrue(np.array_equal(X_new[:, i * 7 + j], expected))
+
+    def test_out_and_dtype(self):
+        """
+        Check writing the result into a given array, keeping float32
+        data as float32 and transforming by blocks of rows.
+        """
+        rng = np.random.RandomState(0)
+        X = rng.randn(25, 4)
+        expected = SumDiffTransformer().fit_transform(X)
+        out = np.zeros([25, 16])
+        self.assertIs(SumDiffTransformer().transform(X, out=out), out)
+        self.assertTrue(np.array_equal(out, expected))
+        with self.assertRaises(ValueError):
+            SumDiffTransformer().transform(X, out=np.zeros([25, 15]))
+        X32 = X.astype(np.float32)
+        self.assertEqual(SumDiffTransformer().transform(X32).dtype, np.float64)
+        self.assertEqual(SumDiffTransformer(dtype=None).transform(X32).dtype, np.float32)
+        self.assertEqual(SumDiffTransformer(dtype=None).transform(X.astype(int)).dtype, np.float64)
+        blocks = list(SumDiffTransformer().transform_blocks(X, block_size=10))
+        self.assertListEqual([len(b) for b in blocks], [10, 10, 5])
+        self.assertTrue(np.array_equal(np.vstack(blocks), expected))
+
+    def test_lazy(self):
+        """
+        Check the lazy matrix returns the same columns as the dense
+        result and keeps no more columns cached than allowed.
+        """
+        rng = np.random.RandomState(0)
+        X = rng.randn(30, 5)
+        expected = SumDiffTransformer().fit_transform(X)
+        lazy = SumDiffTransformer(lazy=True).fit_transform(X)
+        self.assertIsInstance(lazy, SumDiffMatrix)
+        self.assertEqual(lazy.shape, (30, 25))
+        self.assertTrue(np.array_equal(lazy[:, 7], expected[:, 7]))
+        self.assertTrue(np.array_equal(lazy[:, [3, 11, 7, 0]], expected[:, [3, 11, 7, 0]]))
+        self.assertTrue(np.array_equal(lazy[:, 5:15], expected[:, 5:15]))
+        self.assertTrue(np.array_equal(lazy[2:6, [1, 20]], expected[2:6, [1, 20]]))
+        self.assertEqual(lazy[2:6, 4].shape, (4,))
+        self.assertTrue(np.array_equal(lazy[2:6, 4], expected[2:6, 4]))
+        self.assertTrue(np.array_equal(lazy[3, [1, 20]], expected[3, [1, 20]]))
+        self.assertEqual(lazy[3, 4], expected[3, 4])
+        self.assertTrue(np.array_equal(np.asarray(lazy), expected))
+        small = SumDiffMatrix(X, cache_size=3)
+        self.assertTrue(np.array_equal(small[:, :], expected))
+        self.assertEqual(len(small._cache), 3)
+        with self.assertRaises(IndexError):
+            lazy[:, 25]
+
+    def test_k_best(self):
+        """
+        Check the supervised fit keeps the sum or difference columns
+        the target depends on.
+        """
+        rng = np.random.RandomState(0)
+        X = rng.randn(500, 5)
+        noise = rng.randn(500) * 0.01
+        # X[:, 2] - X[:, 4] is the column 2 * 5 + 4, X[:, 1] + X[:, 0]
+        # is the column 1 * 5 + 0.
+        transformer = SumDiffTransformer(k=1).fit(X, X[:, 2] - X[:, 4] + noise)
+        self.assertListEqual(list(transformer.columns_), [14])
+        transformer = SumDiffTransformer(k=1).fit(X, X[:, 1] + X[:, 0] + noise)
+        self.assertListEqual(list(transformer.columns_), [5])
+        transformer = SumDiffTransformer(k=3).fit(X, X[:, 1] + noise)
+        expected = SumDiffTransformer().fit_transform(X)[:, transformer.columns_]
+        self.assertEqual(len(transformer.columns_), 3)
+        self.assertIn(6, transformer.columns_)
+        self.assertTrue(np.allclose(transformer.transform(X), expected))
+        lazy = SumDiffTransformer(k=3, lazy=True).fit(X, X[:, 1] + noise).transform(X)
+        self.assertEqual(lazy.shape, (500, 3))
+        self.assertTrue(np.allclose(lazy[:, 1], expected[:, 1]))
+        with self.assertRaises(ValueError):
+            SumDiffTransformer(k=1).fit(X)
+
+    def test_sparse(self):
+        """
+        Check a sparse matrix is transformed into a sparse matrix with
+        the same values as the dense one.
+        """
+        X = sparse.random(40, 6, density=0.2, format='csr', random_state=0)
+        expected = SumDiffTransformer().fit_transform(X.toarray())
+        X_new = SumDiffTransformer().fit_transform(X)
+        self.assertTrue(sparse.issparse(X_new))
+        self.assertTrue(np.array_equal(X_new.toarray(), expected))
+        self.assertLessEqual(X_new.nnz, 2 * 6 * X.nnz)
+        y = X[:, 1].toarray().ravel() + X[:, 2].toarray().ravel()
+        transformer = SumDiffTransformer(k=1).fit(X, y)
+        self.assertListEqual(list(transformer.columns_), [2 * 6 + 1])
+        self.assertTrue(np.array_equal(transformer.transform(X).toarray(), expected[:, [13]]))
+        with self.assertRaises(ValueError):
+            SumDiffTransformer(lazy=True).transform(X)
+
+    def test_n_jobs(self):
+        """
+        Check filling the result by several threads does not change it.
+        """
+        rng = np.random.RandomState(0)
+        X = rng.randn(50, 9)
+        expected = SumDiffTransformer().fit_transform(X)
+        self.assertTrue(np.array_equal(SumDiffTransformer(n_jobs=4).fit_transform(X), expected))
+        y = X[:, 0] - X[:, 3]
+        transformer = SumDiffTransformer(k=10, n_jobs=4).fit(X, y)
+        self.assertTrue(np.array_equal(transformer.transform(X), expected[:, transformer.columns_]))
+
+    def test_max_memory(self):
+        """
+        Check every memory policy for a result exceeding the limit.
+        """
+        rng = np.random.RandomState(0)
+        X = rng.randn(100, 5)
+        expected = SumDiffTransformer().fit_transform(X)
+        # The result takes 100 * 25 * 8 = 20000 bytes.
+        self.assertTrue(np.array_equal(SumDiffTransformer(max_memory=20000).transform(X), expected))
+        with self.assertRaises(MemoryError):
+            SumDiffTransformer(max_memory=10000).transform(X)
+        X_new = SumDiffTransformer(max_memory=10000, memory_policy='memmap').transform(X)
+        self.assertIsInstance(X_new, np.memmap)
+        self.assertTrue(np.array_equal(X_new, expected))
+        blocks = list(SumDiffTransformer(max_memory=8000, memory_policy='blocks').transform(X))
+        self.assertListEqual([len(b) for b in blocks], [40, 40, 20])
+        self.assertTrue(np.array_equal(np.vstack(blocks), expected))
+        with self.assertRaises(ValueError):
+            SumDiffTransformer(max_memory=10000, memory_policy='swap').transform(X)
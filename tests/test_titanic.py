@@ -64,6 +64,7 @@ class TestExtractTitle(TestCase):
                              [0, 1, 2,
                               2, 3, 4,
                               4, 4, 4])
+        self.assertEqual(titles.dtype, np.int8)
 
     def test_expand_rare_titles(self):
         """
@@ -325,6 +326,21 @@ class TestFamilyPredictor(TestCase):
         Check whether the FamilyPredictor object fills the FamilyRate
         column properly if requested to fill it in basic simplified
         way and to find families by Lastname and Fare fields.
+
+    *   `test_family_ids`
+        Check whether the FamilyPredictor object groups non-alone
+        passengers by Lastname, Pclass and Embarked fields.
+
+    *   `test_merged_families`
+        Check whether lone family members are merged into the families
+        of their secondary last name or of their sisters.
+
+    *   `test_merge_chain`
+        Check how a chain of lone members linked by secondary last names
+        is merged, one by one or transitively.
+
+    *   `test_fare_family_ids`
+        Check the family identifiers assigned by Lastname and Fare fields.
     """
 
     def setUp(self):
@@ -384,3 +400,99 @@ class TestFamilyPredictor(TestCase):
         self.assertAlmostEqual(self.data.FamilyRate[9], 1.0)
         self.assertAlmostEqual(self.data.FamilyRate[10], 0.5)
         self.assertAlmostEqual(self.data.FamilyRate[11], 0.0)
+
+    def test_family_ids(self):
+        """
+        Check whether the FamilyPredictor object groups non-alone
+        passengers by Lastname, Pclass and Embarked fields.
+        """
+        data = pd.DataFrame({"Name": ["Smith, Mr. John",
+                                      "Smith, Mrs. Jane",
+                                      # Another class, so another family.
+                                      "Smith, Mr. Henry",
+                                      # Travels alone, so no family.
+                                      "Jones, Mr. Tom",
+                                      # Another port, so another family.
+                                      "Smith, Miss. Ann",
+                                      "Brown, Mr. Bob"],
+                             "Sex": ["male", "female", "male",
+                                     "male", "female", "male"],
+                             "Pclass": [3, 3, 1, 3, 3, 3],
+                             "Embarked": ["S", "S", "S", "S", "C", "S"],
+                             "SibSp": [1, 1, 0, 0, 0, 0],
+                             "Parch": [0, 0, 1, 0, 1, 1],
+                             "PassengerId": [1, 2, 3, 4, 5, 6],
+                             "Survived": [0, 1, 0, 1, np.NaN, 0]})
+        FamilyPredictor(data)._fill_family_ids()
+        self.assertListEqual(list(data.Family.fillna(-1)), [0, 0, 1, -1, 2, 3])
+
+    def test_merged_families(self):
+        """
+        Check whether lone family members are merged into the families
+        of their secondary last name or of their sisters.
+        """
+        data = pd.DataFrame({"Name": ["Brown, Mr. Tom",
+                                      "Brown, Mrs. Tom",
+                                      # Joins the Browns by her maiden name.
+                                      "Smith, Mrs. John (Mary Brown)",
+                                      "White, Mr. Bob",
+                                      "White, Mrs. Bob (Kate Green)",
+                                      # Joins the Whites if sisters are linked.
+                                      "Jones, Mrs. Tom (Ann Green)"],
+                             "Sex": ["male", "female", "female",
+                                     "male", "female", "female"],
+                             "Pclass": [1, 1, 2, 2, 2, 2],
+                             "Embarked": ["S", "S", "S", "C", "C", "C"],
+                             "SibSp": [1, 1, 0, 1, 1, 1],
+                             "Parch": [0, 0, 1, 0, 0, 0],
+                             "PassengerId": [1, 2, 3, 4, 5, 6],
+                             "Survived": [0, 1, 1, 1, 1, 1]})
+        predictor = FamilyPredictor(data.copy())
+        predictor._fill_family_ids()
+        self.assertListEqual(list(predictor.data.Family), [0, 0, 0, 2, 2, 3])
+        self.assertListEqual(list(predictor.families.Size), [3, 0, 2, 1])
+        predictor = FamilyPredictor(data.copy(), link_sisters=True)
+        predictor._fill_family_ids()
+        self.assertListEqual(list(predictor.data.Family), [0, 0, 0, 2, 2, 2])
+
+    def test_merge_chain(self):
+        """
+        Check how a chain of lone members linked by secondary last names
+        is merged, one by one or transitively.
+        """
+        data = pd.DataFrame({"Name": ["Fox, Mrs. Adam (Ann Gray)",
+                                      "Gray, Mrs. Bill (Beth Hill)",
+                                      "Hill, Mr. Carl",
+                                      "Hill, Mrs. Carl"],
+                             "Sex": ["female", "female", "male", "female"],
+                             "Pclass": [1, 2, 3, 3],
+                             "Embarked": ["S", "S", "S", "S"],
+                             "SibSp": [1, 0, 1, 1],
+                             "Parch": [0, 1, 0, 0],
+                             "PassengerId": [1, 2, 3, 4],
+                             "Survived": [0, 1, 1, 1]})
+        # Fox joins the lone Gray, and Gray is not merged any more.
+        predictor = FamilyPredictor(data.copy())
+        predictor._fill_family_ids()
+        self.assertListEqual(list(predictor.data.Family), [1, 1, 2, 2])
+        self.assertListEqual(list(predictor.families.Size), [0, 2, 2])
+        predictor = FamilyPredictor(data.copy(), merge_transitively=True)
+        predictor._fill_family_ids()
+        self.assertListEqual(list(predictor.data.Family), [2, 2, 2, 2])
+        self.assertListEqual(list(predictor.families.Size), [0, 0, 4])
+
+    def test_fare_family_ids(self):
+        """
+        Check the family identifiers assigned by Lastname and Fare fields.
+        """
+        data = pd.DataFrame({"Name": ["Smith, Mr. John",
+                                      "Jones, Mr. Tom",
+                                      "Smith, Mrs. John",
+                                      "Brown, Mr. Bob"],
+                             "Fare": [10.0, np.NaN, 10.0, 5.0]})
+        predictor = FamilyPredictor(data.copy(), simplified=True, use_fare=True)
+        predictor._fill_family_ids()
+        self.assertListEqual(list(predictor.data.Family.fillna(-1)), [0, -1, 0, 2])
+        predictor = FamilyPredictor(data.copy(), simplified=True, use_fare=True, sort_families=True)
+        predictor._fill_family_ids()
+        self.assertListEqual(list(predictor.data.Family.fillna(-1)), [1, -1, 1, 0])